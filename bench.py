@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+'''
+METAR Clock benchmark suite. Everything runs offline against a canned AWC
+response and fake serial devices, so results are reproducible between commits.
+Numbers are CPU time (time.process_time) per operation unless the unit says
+otherwise, so run this on the clock itself (Pi-class core) for figures that
+mean anything.
+
+    python bench.py                              # print results
+    python bench.py -o bench-$(git rev-parse --short HEAD).json
+    python bench.py --compare old.json           # print ratios against a previous run
+    python bench.py -k render                    # only benchmarks whose name contains "render"
+'''
+
+import io
+import sys
+import random
+import json
+import time
+import struct
+import logging
+import argparse
+import platform
+import subprocess
+from contextlib import redirect_stdout
+from configparser import ConfigParser
+
+import metarclock as mc
+from nexus import Nexus
+from mirror import Mirror
+from stations import StationIndex
+from writer import SerialWriter
+
+TFT_FILE = 'MetarClock-v2_3b.tft'
+
+# Simulated AWC round trip for the startup benchmark, seconds
+AWC_LATENCY = 0.6
+
+# Targets for the benchmarks that have one: (limit, higher is better). Set for a Pi-class core,
+# results are marked OK or MISS. The data page should be up at most 0.4s after the first fetch
+# could possibly have returned, everything else in startup has to overlap with the fetch.
+TARGETS = {
+    'startup.import':     (150, False),
+    'startup.first_data': (AWC_LATENCY * 1000 + 400, False),
+    'writer.touch_latency': (30, False),
+}
+
+SAMPLE_METAR = {
+    'icaoId': 'KLWC', 'reportTime': '2025-10-29T19:00:00.000Z',
+    'wdir': 180, 'wspd': 12, 'wgst': 21, 'temp': 18.3, 'dewp': 4.4,
+    'wxString': '-RA BR', 'visib': '10+', 'altim': 1013.2,
+    'clouds': [{'cover': 'FEW', 'base': 4500}, {'cover': 'BKN', 'base': 9000}],
+}
+SAMPLE_BODY = json.dumps([SAMPLE_METAR]).encode('utf-8')
+# TAF issued 2025-10-29 17:30Z, periods as AWC returns them (epoch seconds)
+TAF_ISSUED = 1761759000
+SAMPLE_TAF = {
+    'icaoId': 'KLWC', 'issueTime': '2025-10-29T17:30:00.000Z', 'validTimeFrom': 1761760800, 'validTimeTo': 1761847200,
+    'fcsts': [
+        {'timeFrom': 1761760800, 'timeTo': 1761775200, 'fcstChange': None, 'wdir': 180, 'wspd': 12, 'wgst': 21,
+         'visib': '6+', 'wxString': None, 'clouds': [{'cover': 'SCT', 'base': 5000}]},
+        {'timeFrom': 1761775200, 'timeTo': 1761789600, 'fcstChange': 'FM', 'wdir': 200, 'wspd': 15, 'wgst': 28,
+         'visib': 3, 'wxString': '-TSRA BR', 'clouds': [{'cover': 'BKN', 'base': 2500, 'type': 'CB'}]},
+        {'timeFrom': 1761778800, 'timeTo': 1761786000, 'fcstChange': 'TEMPO', 'visib': 1.5, 'wxString': 'TSRA',
+         'clouds': [{'cover': 'OVC', 'base': 800, 'type': 'CB'}]},
+        {'timeFrom': 1761789600, 'timeTo': 1761847200, 'fcstChange': 'FM', 'wdir': 320, 'wspd': 10,
+         'visib': '6+', 'wxString': None, 'clouds': [{'cover': 'FEW', 'base': 8000}]},
+    ],
+}
+
+
+# Configuration equivalent to config.ini.sample
+def sampleConfig():
+    config = ConfigParser()
+    config.read_dict({
+        'system':  {'user': 'metar', 'path': '/home', 'tz': 'ct', 'mph': 'True',
+                    'url': 'https://aviationweather.gov/api/data/metar?ids={}&hours=0&format=json'},
+        'awos':    {'station': 'KLWC'},
+        'wifi':    {'ssid': 'network', 'password': 'pass"word'},
+        'display': {'dimhr': '22', 'dimmin': '0', 'brthr': '5', 'brtmin': '45', 'dimval': '16', 'brtval': '83'},
+    })
+    return config
+
+
+### FAKE DEVICES
+# Serial sink that swallows everything, stands in for the Nextion on the clock side
+class NullSerial:
+    in_waiting = 0
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, _data):
+        self.written += len(_data)
+        return len(_data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+
+# Serial port with a receive buffer that can be fed, for serialReceive() framing
+class FeedSerial(NullSerial):
+    def __init__(self):
+        super().__init__()
+        self.buffer = bytearray()
+
+    def feed(self, _data):
+        self.buffer += _data
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def read_until(self, expected=b'\n'):
+        end = self.buffer.find(expected)
+        end = len(self.buffer) if end < 0 else end + len(expected)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+    def read(self, _size=1):
+        data = bytes(self.buffer[:_size])
+        del self.buffer[:_size]
+        return data
+
+
+# Serial port that takes as long as a real UART at its baudrate to send, and notes when a settings
+# page command has been sent
+class UartSerial(NullSerial):
+    baudrate = 115200
+
+    def __init__(self):
+        super().__init__()
+        self.pending  = b''
+        self.settings = None
+
+    def write(self, _data):
+        self.pending = _data
+        return super().write(_data)
+
+    def flush(self):
+        time.sleep(len(self.pending) * 10 / self.baudrate)
+        if b'settings.' in self.pending and self.settings is None:
+            self.settings = time.perf_counter()
+
+
+# Nextion in upload mode: acknowledges the upload command and every 4096 byte block
+class FakeNextion(FeedSerial):
+    def __init__(self):
+        super().__init__()
+        self.baudrate = 115200
+        self.timeout  = 1
+        self.received = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, _data):
+        if _data.startswith(b'whmi-wri'):
+            self.feed(Nexus.NXACK)
+        elif len(_data) > 64 or self.received:
+            self.received += len(_data)
+            self.feed(Nexus.NXACK)
+        return len(_data)
+
+
+# The fake AWC: every request is answered with the canned body, parsed like a real response
+class FakeFetcher(mc.Fetcher):
+    def fetch(self, _url):
+        if '/taf?' in _url:
+            return [SAMPLE_TAF]
+        return json.loads(SAMPLE_BODY)
+
+
+# The fake AWC with a network round trip
+class SlowFetcher(FakeFetcher):
+    def fetch(self, _url):
+        time.sleep(AWC_LATENCY)
+        return super().fetch(_url)
+
+
+# Serial sink that notes when the data page is shown
+class PageSerial(NullSerial):
+    def __init__(self):
+        super().__init__()
+        self.dataPage = None
+
+    def write(self, _data):
+        if b'page data' in _data and self.dataPage is None:
+            self.dataPage = time.perf_counter()
+        return super().write(_data)
+
+
+# A clock on a fake serial port, online through the loopback interface
+def setupClock(_ser=None, _fetcher=FakeFetcher):
+    logging.getLogger().setLevel(logging.CRITICAL)
+    config = sampleConfig()
+    config.set('system', 'interface', 'lo')
+    clock = mc.MetarClock('/dev/null', _fetcher(config['system']['url']), config, _ser if _ser is not None else NullSerial())
+    clock.online = True
+    return clock
+
+
+# Run _func repeatedly for about _seconds of CPU time, return CPU microseconds per call
+def cpuTime(_func, _seconds=1.0):
+    calls = 0
+    start = time.process_time()
+    elapsed = 0
+    while elapsed < _seconds:
+        for _ in range(100):
+            _func()
+        calls += 100
+        elapsed = time.process_time() - start
+    return elapsed / calls * 1e6
+
+
+### BENCHMARKS -- each returns {name: (value, unit)}
+def benchParse():
+    metar = json.loads(SAMPLE_BODY)[0]
+    return {
+        'parse.json':       (cpuTime(lambda: json.loads(SAMPLE_BODY)), 'us'),
+        'parse.reporttime': (cpuTime(lambda: mc.mkDatetime(metar['reportTime'])), 'us'),
+        'parse.record':     (cpuTime(lambda: mc.metarRecord(metar, 'Wednesday October 29, 2025 02:00 PM CDT', True, 'KLWC')), 'us'),
+        'parse.taf_warnings': (cpuTime(lambda: mc.tafWarnings(SAMPLE_TAF, TAF_ISSUED, mc.zones['ct'], True)), 'us'),
+    }
+
+
+def benchRender():
+    record = mc.metarRecord(SAMPLE_METAR, 'Wednesday October 29, 2025 02:00 PM CDT', True, 'KLWC')
+    return {
+        'render.data_page': (cpuTime(lambda: mc.DATA_PAGE.render(record)), 'us'),
+    }
+
+
+def benchUpdate():
+    clock = setupClock()
+    return {
+        'update.metar':        (cpuTime(lambda: clock.METARupdate(0)), 'us'),
+        'update.metar_cached': (cpuTime(clock.METARupdate), 'us'),
+        'update.housekeeping': (cpuTime(clock.housekeepingUpdate), 'us'),
+    }
+
+
+def benchSerialReceive():
+    ser = FeedSerial()
+    clock = setupClock(ser)
+    frame = b'STAKLWC' + mc.EndCom
+
+    def receive():
+        ser.feed(frame)
+        clock.serialReceive()
+    return {
+        'serial.receive': (cpuTime(receive), 'us'),
+    }
+
+
+# Cost of recording, this is paid on every serial write and fetch
+def benchMetrics():
+    return {
+        'metrics.counter_inc':       (cpuTime(lambda: mc.NX_COMMANDS.inc()), 'us'),
+        'metrics.histogram_observe': (cpuTime(lambda: mc.FETCH_TIME.observe(0.3)), 'us'),
+    }
+
+
+# Cost of mirroring a full data page render, paid after every serial write when the mirror is on
+def benchMirror():
+    mirror = Mirror()
+    data = mc.DATA_PAGE.render(mc.metarRecord(SAMPLE_METAR, 'Wednesday October 29, 2025 02:00 PM CDT', True, 'KLWC'))
+    return {
+        'mirror.record_page': (cpuTime(lambda: mirror.record('bench', data)), 'us'),
+    }
+
+
+def benchUpload():
+    with open(TFT_FILE, 'rb') as f:
+        f.seek(0x3c)
+        fileSize = struct.unpack('<I', f.read(4))[0]
+    nxu = Nexus(connect=False)
+    nxu.ser = FakeNextion()
+    nxu.connected = True
+    nxu.uploadSpeed = 921600
+    start = time.process_time()
+    with redirect_stdout(io.StringIO()):
+        nxu.upload(TFT_FILE)
+    elapsed = time.process_time() - start
+    return {
+        'nexus.upload': (fileSize / elapsed / 1e6, 'MB/s'),
+    }
+
+
+# Wall time of a cold start: importing the clock in a fresh interpreter (best of 5), and from the
+# start of the scheduler to the data page with the first METAR on it
+def benchStartup():
+    imports = []
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', 'import metarclock'])
+        imports.append(time.perf_counter() - start)
+    ser = PageSerial()
+    clock = setupClock(ser, SlowFetcher)
+    scheduler = mc.Scheduler([clock], clock.fetcher)
+    start = time.perf_counter()
+    scheduler.start()
+    return {
+        'startup.import':     (min(imports) * 1000, 'ms'),
+        'startup.first_data': ((ser.dataPage - start) * 1000, 'ms'),
+    }
+
+
+# Nearest station lookup on a catalog the size of the AWC METAR list, spread over the CONUS
+def benchStations():
+    rng = random.Random(35)
+    catalog = [['K{:03d}'.format(i), rng.uniform(25, 49), rng.uniform(-125, -67)] for i in range(5000)]
+    start = time.process_time()
+    index = StationIndex(catalog)
+    build = time.process_time() - start
+    return {
+        'stations.index_build': (build * 1000, 'ms'),
+        'stations.nearest':     (cpuTime(lambda: index.nearest(39.01, -95.22, 5, 150)), 'us'),
+    }
+
+
+# Queueing cost of a data page render in the prioritized writer (thread not running, the page keeps
+# superseding itself), and how long a touch echo takes to reach a 115200 baud display with a data page
+# render and a clock tick queued ahead of it
+def benchWriter():
+    data = mc.DATA_PAGE.render(mc.metarRecord(SAMPLE_METAR, 'Wednesday October 29, 2025 02:00 PM CDT', True, 'KLWC'))
+    queueing = SerialWriter(NullSerial(), threaded=False)
+    queueing.threaded = True
+    put = cpuTime(lambda: queueing.put(data))
+
+    latencies = []
+    for _ in range(5):
+        ser = UartSerial()
+        writer = SerialWriter(ser)
+        writer.put(data)
+        writer.put(b'data.dtime.txt="Wednesday October 29, 2025 02:00 PM CDT"' + mc.EndCom)
+        start = time.perf_counter()
+        writer.put(b'settings.station.txt="KLWC"' + mc.EndCom)
+        writer.flush()
+        latencies.append(ser.settings - start)
+    return {
+        'writer.put_page':      (put, 'us'),
+        'writer.touch_latency': (sorted(latencies)[2] * 1000, 'ms'),
+    }
+
+
+BENCHMARKS = (benchStartup, benchParse, benchRender, benchUpdate, benchSerialReceive, benchMetrics, benchMirror, benchWriter, benchStations, benchUpload)
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except Exception:
+        return 'unknown'
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description='METAR Clock benchmark suite')
+    argParser.add_argument('-o', '--output', metavar='FILE', help='Write results as JSON to FILE')
+    argParser.add_argument('--compare', metavar='FILE', help='Compare against a previous JSON result file')
+    argParser.add_argument('-k', metavar='NAME', default='', help='Only run benchmarks whose name contains NAME')
+    args = argParser.parse_args()
+
+    results = {}
+    for bench in BENCHMARKS:
+        if args.k and args.k not in bench.__name__.lower():
+            continue
+        results.update(bench())
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    for name, (value, unit) in results.items():
+        line = '{:<28} {:>10.2f} {:<5}'.format(name, value, unit)
+        if name in baseline:
+            line += ' {:>6.2f}x'.format(value / baseline[name]['value'])
+        if name in TARGETS:
+            limit, higher = TARGETS[name]
+            line += ' {} (target {} {:g})'.format('OK' if (value >= limit if higher else value <= limit) else 'MISS', '>=' if higher else '<=', limit)
+        print(line)
+
+    if args.output:
+        with open(args.output, mode='w') as f:
+            json.dump({
+                'commit':  gitCommit(),
+                'time':    time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python':  platform.python_version(),
+                'machine': platform.machine(),
+                'node':    platform.node(),
+                'results': {name: {'value': value, 'unit': unit} for name, (value, unit) in results.items()},
+            }, f, indent=2)
+        print('Results written to {}'.format(args.output), file=sys.stderr)
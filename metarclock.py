@@ -13,14 +13,27 @@ import logging
 import logging.handlers
 import time
 import json
+import struct
+import argparse
+import threading
 #from urllib.request import Request, build_opener, install_opener
 #from urllib.error import HTTPError, URLError
-import httpx
 from datetime import datetime, timedelta
-from dateutil import parser, tz
 from zoneinfo import ZoneInfo
 from configparser import ConfigParser
 
+# Local modules
+from render import Template, number, text, gauge, thermo, escape
+import metrics
+from metrics import Counter, Histogram, LAG
+from stations import StationIndex, loadCatalog
+from timebase import SystemTime
+from writer import SerialWriter
+
+# Imported where they are used because they are a large part of the startup time and not
+# needed before the first fetch (httpx), the first firmware update (nexus), or at all
+# unless enabled (mirror, cProfile/pstats). Measure with: python -X importtime metarclock.py --help
+
 # Time constants
 zones = {'ut': ZoneInfo('UTC'),'et': ZoneInfo('America/New_York'),'ct':ZoneInfo('America/Chicago'),'mt':ZoneInfo('America/Denver'),'pt':ZoneInfo('America/Los_Angeles'),'lt':get_localzone()}
 
@@ -29,17 +42,14 @@ friendlyTimeZ = '%I:%M %p %Z'
 friendlyDate = '%A %B %d, %Y'
 friendlyTz = '%Z'
 
-### VARIABLE INITIALIZATION
-metar_id    = 0
-lastOnline  = False
-online      = False
-warn        = ''     # string, multi-line 15 characters x 5 lines
-dim         = False
-lastdim     = '10'
-lastbright  = '100'
-ipaddr = 'offline'
+#**** PROGRAM VERSION ****#
+__version__ = "3.0a"
+
+logPFX = '[METARClock V{}]'.format(__version__)
+logger = logging.getLogger()
 
 ### OTHER CONSTANTS
+REOPEN = 30     # seconds between attempts to reopen the port of a failed display
 spinner = ['|','/','--','\\\\']
 # Nextion Commands
 EndCom   = b'\xff\xff\xff'
@@ -68,19 +78,147 @@ HEADER = {
     "Connection": "keep-alive",
 }
 
+### AWC PRODUCTS
+# name: (URL template, TTL seconds, retry seconds after a failed fetch). {} takes a comma separated list
+# of stations. Each product is fetched on its own schedule and shown by the clock's <NAME>update method.
+PRODUCTS = {
+    'metar': ('https://aviationweather.gov/api/data/metar?ids={}&hours=0&format=json', 300, 300),
+    'taf':   ('https://aviationweather.gov/api/data/taf?ids={}&format=json', 3 * 3600, 600),
+}
+
+# Weather in a TAF that does not warrant a warning on its own
+QUIET_WX = ('BR', 'HZ', 'FU', 'DU', 'SA', 'NSW')
+
+### METRICS -- recording is cheap enough to leave on, see metrics.py
+FETCH_TIME   = Histogram('metarclock_fetch_seconds', 'AWC fetch duration')
+FETCH_STATUS = Counter('metarclock_fetch_total', 'AWC fetches by HTTP status', 'code')
+NX_BYTES     = Counter('metarclock_nextion_bytes_total', 'Bytes written to the Nextion')
+NX_COMMANDS  = Counter('metarclock_nextion_commands_total', 'Commands written to the Nextion')
+NX_RESYNCS   = Counter('metarclock_nextion_resyncs_total', 'Nextion resyncs after bad serial data')
+HOUSE_LAG    = Histogram('metarclock_housekeeping_lag_seconds', 'Housekeeping start past its 5s schedule', LAG)
+METAR_LAG    = Histogram('metarclock_metar_lag_seconds', 'METAR update start past its schedule', LAG)
+CFG_TIME     = Histogram('metarclock_cfgupdate_seconds', 'Time spent handling a settings page command')
+FALLBACKS    = Counter('metarclock_fallback_total', 'METARs shown from a nearby station instead of the configured one')
+
+### RENDER TABLES
+# (Nextion component, record field, formatter[, scale]) -- compiled once into pre-encoded commands
+DATA_PAGE = Template((
+    ('data.mtime.pco', 'timeColor', number),            # indicate recent data with green font
+    ('data.mtime.txt', 'mtime',     text()),
+    ('data.dir_g.val', 'wdir',      number),
+    ('data.dir.txt',   'wdir',      text('NA')),
+    ('data.spd_g.val', 'wspd',      number, gauge),     # gauge requires scaling * 9 to display
+    ('data.spd.txt',   'wspd',      text('0')),
+    ('data.gust_g.val','wgst',      number, gauge),     # gauge requires scaling * 9 to display
+    ('data.gust.txt',  'wgst',      text('0')),
+    ('data.temp_g.val','temp',      number, thermo),    # gauge requires scaling * 3 to display
+    ('data.temp.txt',  'temp',      text('NA')),
+    ('data.dewp_g.val','dewp',      number, thermo),    # gauge requires scaling * 3 to display
+    ('data.dewp.txt',  'dewp',      text('NA')),
+    ('data.prcp.txt',  'wx',        text()),
+    ('data.vis.txt',   'visib',     text('', '{} mi')),
+    ('data.alt.txt',   'altim',     text('NA', '{:.2f}')),
+    ('data.sky.txt',   'sky',       text()),
+    ('data.warn.txt',  'warn',      text()),
+    ('data.stat.txt',  'station',   text()),            # station name in white b/c METAR is good, yellow for a nearby fallback
+    ('data.stat.pco',  'statColor', number),
+))
+
+DATA_FAIL = Template((
+    ('data.stat.pco',  'statColor', number),
+    ('data.stat.txt',  'station',   text()),
+    ('data.warn.txt',  'warn',      text()),
+))
+
+SETTINGS_PAGE = Template((
+    ('settings.ipaddr.txt',   'ipaddr',   text()),
+    ('settings.station.txt',  'station',  text()),
+    ('settings.ssid.txt',     'ssid',     text()),
+    ('settings.password.txt', 'password', text()),
+    ('settings.dim_on.txt',   'dimOn',    text()),
+    ('settings.brt_on.txt',   'brtOn',    text()),
+) + tuple(('settings.{}.val'.format(key), key, number) for key in zones))
+
 
 ### Helper functions
 # Create a datetime object from METAR date/time string
 def mkDatetime (_dtimestring):
-    _dtimestring = parser.isoparse(_dtimestring)
-    #_dtimestring = _dtimestring.astimezone(tz.gettz("US/Central"))
-    return _dtimestring #datetime.strptime(_dtimestring, '%Y-%m-%d %H:%M:%S').replace(tzinfo=zones['ut'])
+    return datetime.fromisoformat(_dtimestring.replace('Z', '+00:00'))
+
+# A METAR is stale once its report is more than an hour old, the display shows its time in red
+def metarStale(_metar, _now):
+    try:
+        return _now > mkDatetime(_metar['reportTime']) + timedelta(hours=1)
+    except (KeyError, TypeError, ValueError):
+        return True
+
+# AWC answered but has no current report for the station: missing from the answer (see Fetcher.refresh)
+# or stale. False for transport and HTTP failures, when AWC itself is down and asking it again for the
+# nearby stations would only wait out another timeout.
+def metarMissing(_metar, _now):
+    if type(_metar) is dict:
+        return metarStale(_metar, _now)
+    return _metar == 'METAR Data Bad'
+
+# IFR/MVFR flight category from a forecast's clouds and visibility, '' for VFR or unknown
+def flightCategory(_clouds, _visib):
+    ceiling = min((cloud['base'] for cloud in _clouds or () if cloud.get('cover') in ('BKN', 'OVC', 'OVX', 'VV') and cloud.get('base') is not None), default=None)
+    try:
+        visib = float(str(_visib).rstrip('+'))
+    except ValueError:
+        visib = None
+    for category, ceilingBelow, visibBelow in (('LIFR', 500, 1), ('IFR', 1000, 3), ('MVFR', 3001, 5.01)):
+        if (ceiling is not None and ceiling < ceilingBelow) or (visib is not None and visib < visibBelow):
+            return category
+    return ''
+
+# Warnings for the data page from a TAF: every forecast period in the next _hours that has a flight
+# category below VFR, precipitation or other significant weather, or strong wind (in the clock's speed
+# unit, G for gusts). Periods start with their local start time or NOW and wrap at 15 characters,
+# at most 5 lines.
+def tafWarnings(_taf, _now, _tz, _mph, _hours=6):
+    lines = []
+    last = None
+    for fcst in _taf.get('fcsts', ()):
+        start, end = fcst.get('timeFrom', 0), fcst.get('timeTo', 0)
+        if end <= _now or start >= _now + _hours * 3600:
+            continue
+        items = []
+        category = flightCategory(fcst.get('clouds'), fcst.get('visib'))
+        if category:
+            items.append(category)
+        wx = ' '.join(token for token in (fcst.get('wxString') or '').split() if token.lstrip('+-').replace('VC', '') not in QUIET_WX)
+        if wx:
+            items.append(wx)
+        wspd, wgst = fcst.get('wspd') or 0, fcst.get('wgst') or 0
+        if wgst >= 25 or wspd >= 20:
+            wind = wgst or wspd
+            items.append('{}{}'.format('G' if wgst else 'W', ktom(wind) if _mph else wind))
+        if not items or items == last:
+            continue
+        last = items
+        line = 'NOW' if start <= _now else datetime.fromtimestamp(start, _tz).strftime('%H:%M')
+        for item in ' '.join(items).split():
+            if len(line) + 1 + len(item) > 15:
+                lines.append(line)
+                line = ' '
+            line = '{} {}'.format(line, item)
+        lines.append(line[:15])
+    return '\n'.join(lines[:5])
 
 # Make datetime object "aware" from a supplied timezone
 def mkLocalTime (_dtimestring, _tz):
     return _dtimestring.astimezone(_tz)
 
-# return a friendly string from a datetime object with a supplied format 
+# True once the local wall clock has shown _time's hour and minute today. Comparing datetimes in the same
+# timezone ignores fold, so in the hour repeated when DST ends a time from that hour would look like it is
+# still to come; it counts as passed from its first occurrence. A time skipped in spring passes at the jump.
+def wallPassed(_now, _time):
+    if _time <= _now:
+        return True
+    return bool(_now.fold) and _time.replace(fold=0).utcoffset() != _time.replace(fold=1).utcoffset()
+
+# return a friendly string from a datetime object with a supplied format
 def friendlyT (_datetime, _format):
     return _datetime.strftime(_format)
 
@@ -93,489 +231,975 @@ def ktom(_kts):
     _kts = int(0 if _kts is None else _kts)
     return round(_kts * 1.15078)
 
+# Build the DATA_PAGE record from a METAR: units are converted here, display scaling is in the table
+def metarRecord(_metar, _metarTime, _mph, _station, _warn='', _statColor=white):
+    wspd = _metar.get('wspd') or 0                                          # 2025-09-03 API change doesn't return
+    wgst = _metar.get('wgst') or 0                                          # the key if there is no value
+    temp = _metar.get('temp')
+    dewp = _metar.get('dewp')
+    altim = _metar.get('altim')
+    return {
+        'timeColor': green,
+        'mtime':     _metarTime,
+        'wdir':      _metar.get('wdir'),
+        'wspd':      ktom(wspd) if _mph else wspd,
+        'wgst':      ktom(wgst) if _mph else wgst,
+        'temp':      None if temp is None else ctof(temp),
+        'dewp':      None if dewp is None else ctof(dewp),
+        'wx':        _metar.get('wxString', 'NA'),
+        'visib':     _metar.get('visib'),
+        'altim':     None if altim is None else altim / 33.864,
+        'sky':       ', '.join('{} {}'.format(entry['base'], entry['cover']) for entry in _metar.get('clouds', ())),
+        'warn':      _warn,
+        'station':   _station,
+        'statColor': _statColor,
+    }
 
-
-# get the metar from the weather service and make a rudimentary test to see if the data is ok
-def get_metar(_url):
-    global metar_id
+# Execute a system command -- used ONLY for nmcli (changing WiFi networks)
+def execute(command):
     try:
-        with httpx.Client(http2=True, headers=HEADER, timeout=10) as client:
-            r = client.get(_url)
-        if r.status_code == 200:
-            data = r.json()
-            return data[0] if isinstance(data, list) and data else "METAR Data Bad"
-        logger.warning("[METARClock] AWC HTTP %s", r.status_code)
-        metar_id = 0
-        return "URL Unreachable" if r.status_code == 403 else f"HTTP {r.status_code}"
-    except Exception as e:
-        logger.warning("[METARClock] AWC fetch error: %s", e)
-        metar_id = 0
-        return "URL Unreachable"
-
-# NEW CODE HERE
-def nextion_recover():
-    logger.warning('{} Attempting Nextion resync...'.format(logPFX))
-    ser.reset_input_buffer()
-    ser.reset_output_buffer()
-    ser.write(b'\xff\xff\xff\xff\xff')   # flush any partial command
-    time.sleep(0.05)
-    ser.reset_input_buffer()
-    # Escalate to soft reset if needed — uncomment if flush alone isn't enough:
-    # ser.write(b'rest\xff\xff\xff')
-    # time.sleep(1.5)
-    # ser.reset_input_buffer()
-    logger.warning('{} Nextion resync complete'.format(logPFX))
-
-
-def serialReceive():
-    received = None  # safe default — fixes the unbound variable bug
-
-    if not ser.in_waiting:
+        output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT, universal_newlines=True)
+        return output
+    except subprocess.CalledProcessError as e:
+        logger.error('{} Command execution failed with error code {}: {}'.format(logPFX, e.returncode, e.output))
         return None
 
+# A dropped TFT file is only used once it is complete -- the file size is recorded at 0x3c in the TFT header
+def tftComplete(_tftFile):
     try:
-        raw = ser.read_until(expected=EndCom)
-        received = raw[:-3].decode('utf-8')
-    except UnicodeDecodeError:
-        logger.error('{} Non-UTF8 data from Nextion, triggering resync: {}'.format(logPFX, repr(raw)))
-        nextion_recover()
+        with open(_tftFile, 'rb') as f:
+            f.seek(0x3c)
+            return struct.unpack('<I', f.read(4))[0] <= os.path.getsize(_tftFile)
+    except Exception:
+        return False
+
+
+### SHARED FETCH LAYER
+# One HTTP connection pool for every clock and product in the process. Each product is fetched for all
+# stations in one batched request and cached per station, so clocks showing the same station never fetch twice.
+# The fetcher's time source is the one the whole process runs on, see timebase.py.
+class Fetcher:
+    def __init__(self, url, catalog='', products=None, timebase=None):
+        self.url     = url                  # AWC METAR URL template, {} takes a comma separated list of stations
+        self.products = {'metar': (url,) + PRODUCTS['metar'][1:]}
+        self.products.update(products or {})    # name: (URL template, TTL, retry), see PRODUCTS
+        self.client  = None                 # created on first use, in the prefetch thread at startup
+        self.clientLock = threading.Lock()
+        self.cache   = {}                   # (product, station): (time fetched, parsed dict or error string)
+        self.pending = None                 # prefetch thread, if one is running
+        self.catalog = catalog              # station catalog file for the nearest station fallback, '' disables it
+        self.index   = None                 # StationIndex, loaded in the background
+        self.indexed = 0                    # time the last attempt to load the index started
+        self.loader  = None                 # catalog thread, if one is running
+        self.indexLock = threading.Lock()
+        self.timebase = timebase or SystemTime()
+
+    # Create the shared client, once: the prefetch and catalog threads may both get here first
+    def connect(self):
+        import httpx
+        with self.clientLock:
+            if self.client is None:
+                self.client = httpx.Client(http2=True, headers=HEADER, timeout=10)
+
+    # get a product from the weather service and make a rudimentary test to see if the data is ok.
+    # Returns a list of report dicts (empty if AWC has nothing for the stations) or an error string.
+    def fetch(self, _url):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            if self.client is None:
+                self.connect()
+            r = self.client.get(_url)
+            status = str(r.status_code)
+            if r.status_code == 200:
+                data = r.json()
+                return data if isinstance(data, list) else "Data Bad"
+            logger.warning("[METARClock] AWC HTTP %s", r.status_code)
+            return "URL Unreachable" if r.status_code == 403 else f"HTTP {r.status_code}"
+        except Exception as e:
+            logger.warning("[METARClock] AWC fetch error: %s", e)
+            return "URL Unreachable"
+        finally:
+            # Once per request, a 200 whose body does not decode still counts as a 200
+            FETCH_TIME.observe(time.perf_counter() - start)
+            FETCH_STATUS.inc(_label=status)
+
+    # Download a file with the shared client, returns the body or None
+    def download(self, _url):
+        try:
+            if self.client is None:
+                self.connect()
+            r = self.client.get(_url, timeout=60)
+            if r.status_code == 200:
+                return r.content
+            logger.warning('{} Station catalog download failed: HTTP {}'.format(logPFX, r.status_code))
+        except Exception as e:
+            logger.warning('{} Station catalog download failed: {}'.format(logPFX, e))
         return None
 
-    # \x1a is Nextion's "invalid command" error byte — stream is out of sync
-    if '\x1a' in received:
-        logger.warning('{} Nextion returned 0x1A error byte, triggering resync'.format(logPFX))
-        nextion_recover()
+    # The station index, None until the catalog thread has loaded it. Never waits: the download can take a
+    # minute, most likely just when the fallback is needed because AWC is unreachable. Starts the catalog
+    # thread when there is no index yet, at most once an hour. Returns None if the fallback is disabled.
+    def stationIndex(self):
+        if self.index is None and self.catalog:
+            with self.indexLock:
+                if self.loader is None and self.indexed + 3600 < self.timebase.time():
+                    self.indexed = self.timebase.time()
+                    self.loader = threading.Thread(target=self.loadIndex, name='catalog', daemon=True)
+                    self.loader.start()
+        return self.index
+
+    # Load the catalog (downloaded if needed) and build the index, runs on the catalog thread
+    def loadIndex(self):
+        try:
+            stations = loadCatalog(self.catalog, self.download)
+            if stations:
+                self.index = StationIndex(stations)
+                logger.info('{} Station catalog loaded, {} stations'.format(logPFX, len(self.index)))
+        except Exception as e:
+            logger.error('{} Station catalog {} unusable: {}'.format(logPFX, self.catalog, e))
+        finally:
+            with self.indexLock:
+                self.loader = None
+
+    # Fetch the current _product for all _stations in one request, returns True if AWC answered. Stations
+    # missing from the answer are cached as "<PRODUCT> Data Bad", the newest report of a station is kept.
+    def refresh(self, _stations, _product='metar'):
+        stations = sorted(set(station.upper() for station in _stations))
+        if not stations:
+            return False
+        result = self.fetch(self.products[_product][0].format(','.join(stations)))
+        now = self.timebase.time()
+        if isinstance(result, list):
+            reports = {}
+            for report in result:
+                reports.setdefault(report.get('icaoId'), report)
+            missing = '{} Data Bad'.format(_product.upper())
+            for station in stations:
+                self.cache[(_product, station)] = (now, reports.get(station, missing))
+            return True
+        for station in stations:
+            self.cache[(_product, station)] = (now, result)
+        return False
+
+    # Start the first fetch in the background while the displays are initialized. The network may
+    # still be coming up, so failed fetches are retried for up to _deadline seconds.
+    def prefetch(self, _stations, _deadline=8):
+        def fetch():
+            end = self.timebase.time() + _deadline
+            while not self.refresh(_stations) and self.timebase.time() < end:
+                self.timebase.sleep(0.5)
+        self.pending = threading.Thread(target=fetch, name='prefetch', daemon=True)
+        self.pending.start()
+        # Have the station index ready before it is needed, without holding up the first METAR
+        self.stationIndex()
+
+    # Wait for a running prefetch to finish
+    def wait(self, _timeout=None):
+        if self.pending is not None:
+            self.pending.join(_timeout)
+            if not self.pending.is_alive():
+                self.pending = None
+
+    # _product for one station, fetched only if the cached one is older than _maxAge seconds (default the TTL)
+    def get(self, _product, _station, _maxAge=None):
+        station = _station.upper()
+        maxAge = self.products[_product][1] if _maxAge is None else _maxAge
+        cached = self.cache.get((_product, station))
+        if cached is None or cached[0] + maxAge < self.timebase.time():
+            self.refresh([station], _product)
+        return self.cache[(_product, station)][1]
+
+    # _product for one station as last fetched, None if it never was. Never fetches.
+    def cached(self, _product, _station):
+        cached = self.cache.get((_product, _station.upper()))
+        return None if cached is None else cached[1]
+
+    # The METAR for one station, fetched only if the cached one is older than _maxAge seconds. Waits up to
+    # _wait seconds for a running prefetch, which most likely brings it.
+    def metar(self, _station, _maxAge=60, _wait=10):
+        self.wait(_wait)
+        return self.get('metar', _station, _maxAge)
+
+    # The closest valid, current METAR near _station, for when its own report is missing or stale. The
+    # _k nearest stations within _maxKm come from the index and are fetched in one batched request.
+    # Returns (METAR, km) or None, also while the index is still loading.
+    def nearest(self, _station, _k=5, _maxKm=150, _maxAge=60):
+        index = self.stationIndex()
+        station = _station.upper()
+        if index is None or station not in index.position:
+            return None
+        lat, lon = index.position[station]
+        candidates = index.nearest(lat, lon, _k, _maxKm, (station,))
+        now = self.timebase.time()
+        missing = [nearby for km, nearby in candidates if ('metar', nearby) not in self.cache or self.cache[('metar', nearby)][0] + _maxAge < now]
+        if missing:
+            self.refresh(missing)
+        for km, nearby in candidates:
+            metar = self.cache[('metar', nearby)][1]
+            if type(metar) is dict and not metarStale(metar, self.timebase.now(zones['ut'])):
+                return metar, km
         return None
 
-    if ser.in_waiting:
-        errSerial = ser.read(ser.in_waiting)
-        logger.error('{} Valid received: {}, but unexpected serial data waiting: {}'.format(logPFX, repr(received), repr(errSerial)))
-        ser.reset_input_buffer()
 
-    return received
-# END NEW CODE
+### ONE CLOCK PER DISPLAY
+class MetarClock:
+    # Drop files being flashed, shared by the displays of this process: path: {'taken': displays that took
+    # it, 'flashing': how many of them are still at it, 'failed': whether any upload failed}
+    drops = {}
+
+    def __init__(self, cfgFile, fetcher, config=None, ser=None):
+        self.cfgFile = cfgFile
+        self.fetcher = fetcher
+
+        # Read external configuration file
+        if config is None:
+            config = ConfigParser()
+            config.read(cfgFile)
+        self.config = config
+
+        #**** YOU WILL NEED TO CHANGE THESE THINGS IN config.ini ****#
+        # Things that are PLATFORM AND INSTALLATION SPECIFIC (ie SBC and/or OS and user)
+        self.serialDevice = config.get('system', 'serial', fallback='/dev/ttyS1')
+        self.netInterface = config.get('system', 'interface', fallback='wlan0')
+        # TFT files dropped here are flashed to the display by the running clock
+        self.tftDrop      = config.get('system', 'tftdrop', fallback=os.path.join(os.path.dirname(cfgFile), 'update.tft'))
+        self.name         = os.path.basename(self.serialDevice)
+        self.logPFX       = '{} {}]'.format(logPFX[:-1], self.name)
+        self.mirror       = None                # web mirror of everything written to the display, if enabled
+        # Nearest station fallback: how many nearby stations to try and how far away (km), 0 disables it
+        self.fallback     = config.getint('fallback', 'nearest', fallback=5) if fetcher.catalog else 0
+        self.fallbackKm   = config.getfloat('fallback', 'radius', fallback=150)
+
+        ### VARIABLE INITIALIZATION
+        self.metar_id   = 0
+        self.lastOnline = False
+        self.online     = False
+        self.warn       = ''     # string, multi-line 15 characters x 5 lines, upcoming conditions from the TAF
+        self.tafHours   = config.getint('taf', 'hours', fallback=6)    # how far ahead the TAF warnings look
+        self.dim        = False
+        self.lastdim    = '10'
+        self.lastbright = '100'
+        self.ipaddr     = 'offline'
+        self.metarDTime = None
+
+        # A display whose port fails is taken out of the loop and reopened by the Scheduler (see service()),
+        # so one unplugged panel never stops the others or keeps the process from starting.
+        self.baudrate   = 115200
+        self.failed     = 0      # time the port failed, 0 while the display works
+        self.updating   = None   # firmware upload thread, while one runs
+        self.tftFile    = None   # TFT file of the last firmware upload
+        self.uploaded   = None   # result of the last firmware upload
+        self.ser        = ser
+        if ser is None:
+            try:
+                self.ser = self.openSerial(self.baudrate)
+            except Exception as e:
+                self.fail(e)
+
+        # Output goes through a prioritized writer thread, see writer.py. A port handed in (bench, soak) is
+        # written synchronously so writes happen at the caller's time.
+        self.writer = SerialWriter(self.ser, self.written, threaded=ser is None, failed=self.fail)
+
+    # Open the serial port to the Nextion
+    def openSerial(self, _baudrate):
+        return serial.Serial(
+          port=self.serialDevice,
+          baudrate = _baudrate,
+          parity = serial.PARITY_NONE,
+          stopbits = serial.STOPBITS_ONE,
+          bytesize = serial.EIGHTBITS,
+          timeout = 2 # timeout in reception in seconds
+        )
+
+    # Take the display out of the loop after its port failed, the Scheduler retries it every REOPEN seconds.
+    # Also called from the writer thread when a write fails, only the first failure is logged.
+    def fail(self, _error):
+        if self.failed:
+            return
+        logger.error('{} Display failed, retrying every {}s: {}'.format(self.logPFX, REOPEN, _error))
+        self.failed = self.fetcher.timebase.time()
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+
+    # True while the display takes part in the main loop: its port works and no firmware upload owns it
+    def active(self):
+        return not self.failed and self.updating is None
+
+    # Reopen the port of a failed display and repaint everything
+    def reopen(self):
+        self.failed = self.fetcher.timebase.time()
+        try:
+            self.ser = self.writer.ser = self.openSerial(self.baudrate)
+        except Exception as e:
+            logger.warning('{} Display still unavailable: {}'.format(self.logPFX, e))
+            return
+        self.failed = 0
+        logger.info('{} Display back at {} baud'.format(self.logPFX, self.baudrate))
+        self.startup()
+
+    # Called by the Scheduler every pass for displays that are out of the loop: retry failed ones and
+    # bring a display back once its firmware upload thread has finished
+    def service(self, _now):
+        if self.updating is not None:
+            if self.updating.is_alive():
+                return
+            self.updating = None
+            if self.tftFile == self.tftDrop:
+                self.dropDone()
+            self.reopen()
+        elif self.failed and self.failed + REOPEN <= _now:
+            self.reopen()
+
+    # The current time in the timezone we're asking the clock to display
+    def localNow(self):
+        return self.fetcher.timebase.now(zones[self.config['system']['tz']])
+
+    def nextion_recover(self):
+        ser = self.ser
+        logger.warning('{} Attempting Nextion resync...'.format(self.logPFX))
+        NX_RESYNCS.inc()
+        with self.writer.lock:                  # keep the writer thread off the port meanwhile
+            ser.reset_input_buffer()
+            ser.reset_output_buffer()
+            ser.write(b'\xff\xff\xff\xff\xff')   # flush any partial command
+            time.sleep(0.05)
+            ser.reset_input_buffer()
+        # Escalate to soft reset if needed — uncomment if flush alone isn't enough:
+        # ser.write(b'rest\xff\xff\xff')
+        # time.sleep(1.5)
+        # ser.reset_input_buffer()
+        logger.warning('{} Nextion resync complete'.format(self.logPFX))
+
+    # Receive data from the Nextion
+    def serialReceive(self):
+        ser = self.ser
+        received = None  # safe default — fixes the unbound variable bug
+
+        if not ser.in_waiting:
+            return None
+
+        try:
+            raw = ser.read_until(expected=EndCom)
+            received = raw[:-3].decode('utf-8')
+        except UnicodeDecodeError:
+            logger.error('{} Non-UTF8 data from Nextion, triggering resync: {}'.format(self.logPFX, repr(raw)))
+            self.nextion_recover()
+            return None
+
+        # \x1a is Nextion's "invalid command" error byte — stream is out of sync
+        if '\x1a' in received:
+            logger.warning('{} Nextion returned 0x1A error byte, triggering resync'.format(self.logPFX))
+            self.nextion_recover()
+            return None
 
-''' REPLACED CODE FOLLOWS
-# Receive data from the Nextion
-def serialReceive():
-    if ser.in_waiting:
-        received = ser.read_until(expected=EndCom)[:-3].decode('utf-8')
         if ser.in_waiting:
             errSerial = ser.read(ser.in_waiting)
-            logger.error('{} Vaid received: {}, but unexpected serial data waiting: {}'.format(logPFX, repr(received), repr(errSerial)))
+            logger.error('{} Valid received: {}, but unexpected serial data waiting: {}'.format(self.logPFX, repr(received), repr(errSerial)))
             ser.reset_input_buffer()
-    return received if received else None
-'''
-# Send a string to the Nextion, making it a bytes object in utf-8, and sending the EndCom
-def nextionWrite(_string):
-    _val = bytes(_string, 'utf-8')
-    _val += EndCom
-    ser.write(_val)
-
-# Convert all type None items in METAR to 0. Only used for workaround/development
-def dictClean(dirty):
-    clean = {}
-    for key, value in dirty:
-        if value is None:
-            value = 0
-        clean[key] = value
-    return clean
 
-# Execute a system command -- used ONLY for nmcli (changing WiFi networks)
-def execute(command):
-    try:
-        output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT, universal_newlines=True)
-        return output
-    except subprocess.CalledProcessError as e:
-        logger.error('{} Command execution failed with error code {}: {}'.format(logPFX, e.returncode, e.output))
-        return None
+        return received
+
+    # Send a string to the Nextion, making it a bytes object in utf-8, and sending the EndCom
+    def nextionWrite(self, _string):
+        _val = bytes(_string, 'utf-8')
+        _val += EndCom
+        self.writer.put(_val)
+
+    # Send already encoded, EndCom terminated commands (a rendered template) to the Nextion
+    def nextionSend(self, _bytes):
+        self.writer.put(_bytes)
+
+    # Called by the writer with everything that actually reached the display
+    def written(self, _bytes):
+        NX_BYTES.inc(len(_bytes))
+        NX_COMMANDS.inc(_bytes.count(EndCom))
+        if self.mirror is not None:
+            self.mirror.record(self.name, _bytes)
 
-# Check for active network connection
-def checkOnline():
-    global ipaddr, online, lastOnline
-    online = AF_INET in ifaddresses(netInterface)
-    if online != lastOnline:
-        if online:
-            nextionWrite('data.nowifi.aph=0')       # turn off no wifi icon
-            nextionWrite('data.wifi.aph=127')       # turn on wifi icon
-            ipaddr = ifaddresses(netInterface)[2][0]['addr']
-        else:
-            nextionWrite('data.wifi.aph=0')
-            nextionWrite('data.nowifi.aph=127')
-            ipaddr = 'Offline'
-        lastOnline = online
-        nextionWrite('settings.ipaddr.txt=\"{}\"'.format(ipaddr))
-        logger.info('{} WiFi interface change detected, IP Address: {}'.format(logPFX, ipaddr))
-    return online
-
-# Write the configuration file
-def writeConfig():
-    try:
-        with open(cfgFile, mode='w') as configFile:
-            config.write(configFile)
-        logger.info('{} Successful configuration file write during user configuration'.format(logPFX))
-    except Exception as e:
-        logger.error('{} Could not write configuration file: {}'.format(logPFX, e))
-
-### STUFF DONE ONCE ON STARTUP
-def startup():
-    global lastOnline, online, lastdim, lastbright, ipaddr, dim
-
-    # Set the nextion for startup
-    nextionWrite('page splash')
-   
     # Check for active network connection
-    # This is a one-off for the startup routine
-    online = AF_INET in ifaddresses(netInterface)
-    if not online:
-        for i in range(72):
-            nextionWrite('splash.ipaddr.txt=\"{}\"'.format(spinner[i%4]))
-            time.sleep(.1)
-            online = AF_INET in ifaddresses(netInterface)
-            if online:
-                break
-    
-    # Handle whether we're using MPH or KT for this clock
-    if eval(config['system']['mph']) == True:
-        nextionWrite('settings.spdunit.txt=\"MPH\"')
-        nextionWrite('data.mph.aph=127')       # turn on MPH
-        nextionWrite('data.kt.aph=0')          # turn off KT
-    else:
-        nextionWrite('settings.spdunit.txt=\"KT\"')
-        nextionWrite('data.kt.aph=127')        # turn on KT
-        nextionWrite('data.mph.aph=0')         # turn off MPH
-
-    # Handle WiFi icon on splash, data and settings pages
-    checkOnline()
-    nextionWrite('splash.ipaddr.txt=\"{}\"'.format(ipaddr))
-    time.sleep(2)          # Ensures we see the IP address on the display briefly before starting the main loop
-
-    # Set all settings page items to the initial value from the saved configuration file
-    nextionWrite('settings.ipaddr.txt=\"{}\"'.format(ipaddr))
-    nextionWrite('settings.station.txt=\"{}\"'.format(config['awos']['station']))
-    nextionWrite('settings.ssid.txt=\"{}\"'.format(config['wifi']['ssid']))
-    nextionWrite('settings.password.txt="{}\"'.format(config['wifi']['password']))
-    nextionWrite('settings.dim_on.txt=\"{}:{:02d}\"'.format(config['display']['dimhr'],int(config['display']['dimmin'])))
-    nextionWrite('settings.brt_on.txt=\"{}:{:02d}\"'.format(config['display']['brthr'],int(config['display']['brtmin']))) 
-    for key in zones.keys():
-        if key == config['system']['tz']:
-            nextionWrite('settings.{}.val=1'.format(key))
+    def checkOnline(self):
+        self.online = AF_INET in ifaddresses(self.netInterface)
+        if self.online != self.lastOnline:
+            if self.online:
+                self.nextionWrite('data.nowifi.aph=0')       # turn off no wifi icon
+                self.nextionWrite('data.wifi.aph=127')       # turn on wifi icon
+                self.ipaddr = ifaddresses(self.netInterface)[2][0]['addr']
+            else:
+                self.nextionWrite('data.wifi.aph=0')
+                self.nextionWrite('data.nowifi.aph=127')
+                self.ipaddr = 'Offline'
+            self.lastOnline = self.online
+            self.nextionWrite('settings.ipaddr.txt=\"{}\"'.format(self.ipaddr))
+            logger.info('{} WiFi interface change detected, IP Address: {}'.format(self.logPFX, self.ipaddr))
+        return self.online
+
+    # Write the configuration file
+    def writeConfig(self):
+        try:
+            with open(self.cfgFile, mode='w') as configFile:
+                self.config.write(configFile)
+            logger.info('{} Successful configuration file write during user configuration'.format(self.logPFX))
+        except Exception as e:
+            logger.error('{} Could not write configuration file: {}'.format(self.logPFX, e))
+
+    ### STUFF DONE ONCE ON STARTUP
+    def startup(self):
+        config = self.config
+
+        # Set the nextion for startup
+        self.nextionWrite('page splash')
+
+        # Check for active network connection
+        # This is a one-off for the startup routine
+        self.online = AF_INET in ifaddresses(self.netInterface)
+        if not self.online:
+            for i in range(72):
+                self.nextionWrite('splash.ipaddr.txt=\"{}\"'.format(spinner[i%4]))
+                time.sleep(.1)
+                self.online = AF_INET in ifaddresses(self.netInterface)
+                if self.online:
+                    break
+
+        # Handle whether we're using MPH or KT for this clock
+        if eval(config['system']['mph']) == True:
+            self.nextionWrite('settings.spdunit.txt=\"MPH\"')
+            self.nextionWrite('data.mph.aph=127')       # turn on MPH
+            self.nextionWrite('data.kt.aph=0')          # turn off KT
         else:
-            nextionWrite('settings.{}.val=0'.format(key))
-    
-    # This is really complicated b/c time "rols over" at midnight. I fix this by determining
-    # the span of time within a day, and whether the clock should be bright or dim during
-    # that span. This allows me to set the opposite condition outside of that span without
-    # having to calculate what happens with rollover at mightnight. This is almost exactly
-    # duplicated in the housekeeping routing, except that there, we care about knowing what
-    # value is already set (so we don't keep resetting the display), but this is an initial
-    # setting, so we leave out the test to determine what state the display is already in.
-    currentDTime = datetime.now().astimezone(get_localzone())                   # Getting datetime.now will produce an unaware time in the local TZ -- make it aware
-    currentDTime = currentDTime.astimezone(zones[config['system']['tz']])       # Convert it into the timezone we're asking it to display.
-
-    nowTime  = currentDTime.replace(second=0, microsecond=0)
-    brightTime = nowTime.replace(hour=int(config['display']['brthr']),  minute=int(config['display']['brtmin']))
-    dimTime    = nowTime.replace(hour=int(config['display']['dimhr']),  minute=int(config['display']['dimmin']))
-
-    if dimTime > brightTime:                                                    # *** The "bright" time is during the day because we go dim later than we go bright
-        if nowTime >= brightTime and nowTime < dimTime:                         #       We are within the window to be bright
-            nextionWrite('dim={}'.format(int(config['display']['brtval'])))           #       Change to bright
-            dim = False                                                         #       Flag that we're now bright
-            logger.info('{} Display initialized to BRIGHT: {} (datime bright)'.format(logPFX, nowTime))
-        if not (nowTime >= brightTime and nowTime < dimTime):                   #       We are outside the window to be bright
-            nextionWrite('dim={}'.format(int(config['display']['dimval'])))                               #       Change to dim
-            dim = True                                                          #       Flag that we're now dim 
-            logger.info('{} Display initialized to DIM: {} (datime bright)'.format(logPFX, nowTime))
-    if dimTime < brightTime:                                                    # *** The "dim" time is during the day because we go bright later than we go dim
-        if nowTime >= dimTime and nowTime < brightTime :                        #       We are within the window to be dim
-            nextionWrite('dim={}'.format(int(config['display']['dimval'])))                               #       change to dim
-            dim = True                                                          #       Flag that we're now dim
-            logger.info('{} Display initialized to DIM: {} (daytime dim)'.format(logPFX, nowTime))
-        if not (nowTime >= dimTime and nowTime < brightTime):                   #       We are outside the window to be dim
-            nextionWrite('dim={}'.format(int(config['display']['brtval'])))                               #       change to bright
-            dim = False                                                         #       Flag that we're now bright
-            logger.info('{} Display initialized to BRIGHT: {} (daytime dim)'.format(logPFX, nowTime))
-
-    # Setup last display values from config file
-    lastbright = config['display']['brtval']
-    lastdim = config['display']['dimval']
-    
-    # Move to the data page before beginning to loop
-    nextionWrite('page data')
-
-
-
-### HOUSEKEEPING LOOP (TIME, NETWORK and SUCH)
-def housekeepingUpdate():
-    global lastOnline, online, ipaddr, dim
-    
-    # Check for active network connection
-    checkOnline()
-
-    # Time gets updated even if the METAR isn't new
-    currentDTime = datetime.now().astimezone(get_localzone())                   # Getting datetime.now will produce an unaware time in the local TZ -- make it aware
-    currentDTime = currentDTime.astimezone(zones[config['system']['tz']])       # Convert it into the timezone we're asking it to display.
-    currentTime = '{} {}'.format(friendlyT(currentDTime, friendlyDate), friendlyT(currentDTime, friendlyTimeZ))
-    #logger.debug('{} Loop Run @ {}'.format(logPFX, currentTime))
-    nextionWrite('data.dtime.txt=\"{}\"'.format(currentTime))
-    
-    # Time of day to dim the display
-    try:
-        nowTime  = currentDTime.replace(second=0, microsecond=0)
-        brightTime = nowTime.replace(hour=int(config['display']['brthr']),  minute=int(config['display']['brtmin']))
-        dimTime    = nowTime.replace(hour=int(config['display']['dimhr']),  minute=int(config['display']['dimmin']))
+            self.nextionWrite('settings.spdunit.txt=\"KT\"')
+            self.nextionWrite('data.kt.aph=127')        # turn on KT
+            self.nextionWrite('data.mph.aph=0')         # turn off MPH
+
+        # Handle WiFi icon on splash, data and settings pages. The IP address stays on the splash
+        # page until the first METAR is in.
+        self.checkOnline()
+        self.nextionWrite('splash.ipaddr.txt=\"{}\"'.format(self.ipaddr))
+
+        # Set all settings page items to the initial value from the saved configuration file
+        settings = {
+            'ipaddr':   self.ipaddr,
+            'station':  config['awos']['station'],
+            'ssid':     config['wifi']['ssid'],
+            'password': config['wifi']['password'],
+            'dimOn':    '{}:{:02d}'.format(config['display']['dimhr'], int(config['display']['dimmin'])),
+            'brtOn':    '{}:{:02d}'.format(config['display']['brthr'], int(config['display']['brtmin'])),
+        }
+        for key in zones.keys():
+            settings[key] = int(key == config['system']['tz'])
+        self.nextionSend(SETTINGS_PAGE.render(settings))
 
         # This is really complicated b/c time "rols over" at midnight. I fix this by determining
         # the span of time within a day, and whether the clock should be bright or dim during
         # that span. This allows me to set the opposite condition outside of that span without
-        # having to calculate what happens with rollover at mightnight. 
+        # having to calculate what happens with rollover at mightnight. This is almost exactly
+        # duplicated in the housekeeping routing, except that there, we care about knowing what
+        # value is already set (so we don't keep resetting the display), but this is an initial
+        # setting, so we leave out the test to determine what state the display is already in.
+        currentDTime = self.localNow()
+
+        nowTime  = currentDTime.replace(second=0, microsecond=0)
+        brightTime = nowTime.replace(hour=int(config['display']['brthr']),  minute=int(config['display']['brtmin']))
+        dimTime    = nowTime.replace(hour=int(config['display']['dimhr']),  minute=int(config['display']['dimmin']))
+        brightPassed = wallPassed(nowTime, brightTime)
+        dimPassed    = wallPassed(nowTime, dimTime)
+
         if dimTime > brightTime:                                                    # *** The "bright" time is during the day because we go dim later than we go bright
-            if nowTime >= brightTime and nowTime < dimTime and dim == True:         #       We are within the window to be bright, and the display is currently dim
-                nextionWrite('dim={}'.format(int(config['display']['brtval'])))     #       Change to bright
-                dim = False                                                         #       Flag that we're now bright
-                logger.info('{} Display changed to BRIGHT: {} (datime bright)'.format(logPFX, nowTime))
-            if not (nowTime >= brightTime and nowTime < dimTime) and dim == False:  #       We are outside the window to be bright and the diplay is bright
-                nextionWrite('dim={}'.format(int(config['display']['dimval'])))                               #       Change to dim
-                dim = True                                                          #       Flag that we're now dim 
-                logger.info('{} Display changed to DIM: {} (datime bright)'.format(logPFX, nowTime))
+            if brightPassed and not dimPassed:                                      #       We are within the window to be bright
+                self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))      #       Change to bright
+                self.dim = False                                                    #       Flag that we're now bright
+                logger.info('{} Display initialized to BRIGHT: {} (datime bright)'.format(self.logPFX, nowTime))
+            if not (brightPassed and not dimPassed):                                #       We are outside the window to be bright
+                self.nextionWrite('dim={}'.format(int(config['display']['dimval'])))      #       Change to dim
+                self.dim = True                                                     #       Flag that we're now dim
+                logger.info('{} Display initialized to DIM: {} (datime bright)'.format(self.logPFX, nowTime))
         if dimTime < brightTime:                                                    # *** The "dim" time is during the day because we go bright later than we go dim
-            if nowTime >= dimTime and nowTime < brightTime and dim == False:        #       We are within the window to be dim, and the display is currently bright
-                nextionWrite('dim={}'.format(int(config['display']['dimval'])))                               #       change to dim
-                dim = True                                                          #       Flag that we're now dim
-                logger.info('{} Display changed to DIM: {} (daytime dim)'.format(logPFX, nowTime))
-            if not (nowTime >= dimTime and nowTime < brightTime) and dim == True:   #       We are outside the window to be dim and the display is dim
-                nextionWrite('dim={}'.format(int(config['display']['brtval'])))                               #       change to bright
-                dim = False                                                         #       Flag that we're now bright
-                logger.info('{} Display changed to BRIGHT: {} (daytime dim)'.format(logPFX, nowTime))
-    except Exception as e:
-        nextionWrite('dim={}'.format(int(config['display']['brtval'])))
-        logger.error('{} Error Processing BRIGHT/DIM ({}) housekeeping: {}'.format(logPFX, dim, e))
-
-    if lastbright != config['display']['brtval'] and not dim:
-        nextionWrite('dim={}'.format(int(config['display']['brtval'])))
-    if lastdim != config['display']['dimval'] and dim:
-        nextionWrite('dim={}'.format(int(config['display']['dimval'])))
-
-### METAR UPDATE LOOP
-def METARupdate():
-    logger.debug('{} METARupdate Loop Started: {}'.format(logPFX, time.time()))
-    global metar_id, metarDTime, lastOnline, online, dim
-    metar = 'uninitialized METAR'
-
-    currentDTime = datetime.now().astimezone(get_localzone())                   # Getting datetime.now will produce an unaware time in the local TZ -- make it aware
-    currentDTime = currentDTime.astimezone(zones[config['system']['tz']])       # Convert it into the timezone we're asking it to display.
-
-    url   = config['system']['url'].format(config['awos']['station'])
-    
-    if online == True:
-        metar = get_metar(url)
-        if type(metar) is dict:
-            #if metar_id != metar['icaoId']:
-            #    metar_id = metar['icaoId']
-            #if metar_id == metar['icaoId']:
-            logger.info('{} New METAR Received with ID {}'.format(logPFX, metar['icaoId']))
-            nextionWrite('data.stat.pco={}'.format(white))
-
-            # Metar Time Conversion
-            metarRTime = mkDatetime(metar['reportTime'])
-            metarDTime = mkLocalTime(metarRTime, zones[config['system']['tz']])
-            metarTime = '{} {}'.format(friendlyT(metarDTime, friendlyDate), friendlyT(metarDTime, friendlyTimeZ))
-
-            # Metar Time
-            nextionWrite('data.mtime.pco={}'.format(green))              # indicate recent data data with green font
-            nextionWrite('data.mtime.txt=\"{}\"'.format(metarTime))      # display time
-
-            # Wind Direction
-            if 'wdir' not in metar: metar['wdir'] = None
-            nextionWrite('data.dir_g.val={}'.format(0 if metar['wdir'] == None else metar['wdir']))         # display guage
-            nextionWrite('data.dir.txt=\"{}\"'.format('NA' if metar['wdir'] == None else metar['wdir']))    # display digital
-
-            # Wind Speed
-            if 'wspd' not in metar: metar['wspd'] = None
-            spd = 0 if metar['wspd'] == None else metar['wspd']                 # set None type to 0
-            spd = ktom(spd) if eval(config['system']['mph']) == True else spd   # convert to MPH if configured -- eval turn text into boolean
-            nextionWrite('data.spd_g.val={}'.format((spd * 9)%360))             # Gauge requires scaling * 9 to display
-            nextionWrite('data.spd.txt=\"{}\"'.format(spd))
-
-            # Wind gusts
-            # 2025-09-03 API change doesn't return the key if there is no value
-            if 'wgst' not in metar:
-                spd = 0
-                metar['wgst'] = None
+            if dimPassed and not brightPassed:                                      #       We are within the window to be dim
+                self.nextionWrite('dim={}'.format(int(config['display']['dimval'])))      #       change to dim
+                self.dim = True                                                     #       Flag that we're now dim
+                logger.info('{} Display initialized to DIM: {} (daytime dim)'.format(self.logPFX, nowTime))
+            if not (dimPassed and not brightPassed):                                #       We are outside the window to be dim
+                self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))      #       change to bright
+                self.dim = False                                                    #       Flag that we're now bright
+                logger.info('{} Display initialized to BRIGHT: {} (daytime dim)'.format(self.logPFX, nowTime))
+
+        # Setup last display values from config file
+        self.lastbright = config['display']['brtval']
+        self.lastdim = config['display']['dimval']
+
+        # Fill the data page with the first METAR (prefetched since process start, METARupdate waits for it
+        # up to 10s), then show it
+        self.housekeepingUpdate()
+        self.METARupdate()
+
+        # Move to the data page before beginning to loop
+        self.nextionWrite('page data')
+
+    ### HOUSEKEEPING LOOP (TIME, NETWORK and SUCH)
+    def housekeepingUpdate(self):
+        config = self.config
+
+        # Check for active network connection
+        self.checkOnline()
+
+        # Time gets updated even if the METAR isn't new
+        currentDTime = self.localNow()
+        currentTime = '{} {}'.format(friendlyT(currentDTime, friendlyDate), friendlyT(currentDTime, friendlyTimeZ))
+        #logger.debug('{} Loop Run @ {}'.format(self.logPFX, currentTime))
+        self.nextionWrite('data.dtime.txt=\"{}\"'.format(currentTime))
+
+        # Time of day to dim the display
+        try:
+            nowTime  = currentDTime.replace(second=0, microsecond=0)
+            brightTime = nowTime.replace(hour=int(config['display']['brthr']),  minute=int(config['display']['brtmin']))
+            dimTime    = nowTime.replace(hour=int(config['display']['dimhr']),  minute=int(config['display']['dimmin']))
+            brightPassed = wallPassed(nowTime, brightTime)
+            dimPassed    = wallPassed(nowTime, dimTime)
+
+            # This is really complicated b/c time "rols over" at midnight. I fix this by determining
+            # the span of time within a day, and whether the clock should be bright or dim during
+            # that span. This allows me to set the opposite condition outside of that span without
+            # having to calculate what happens with rollover at mightnight.
+            if dimTime > brightTime:                                                        # *** The "bright" time is during the day because we go dim later than we go bright
+                if brightPassed and not dimPassed and self.dim == True:                     #       We are within the window to be bright, and the display is currently dim
+                    self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))    #       Change to bright
+                    self.dim = False                                                        #       Flag that we're now bright
+                    logger.info('{} Display changed to BRIGHT: {} (datime bright)'.format(self.logPFX, nowTime))
+                if not (brightPassed and not dimPassed) and self.dim == False:              #       We are outside the window to be bright and the diplay is bright
+                    self.nextionWrite('dim={}'.format(int(config['display']['dimval'])))    #       Change to dim
+                    self.dim = True                                                         #       Flag that we're now dim
+                    logger.info('{} Display changed to DIM: {} (datime bright)'.format(self.logPFX, nowTime))
+            if dimTime < brightTime:                                                        # *** The "dim" time is during the day because we go bright later than we go dim
+                if dimPassed and not brightPassed and self.dim == False:                    #       We are within the window to be dim, and the display is currently bright
+                    self.nextionWrite('dim={}'.format(int(config['display']['dimval'])))    #       change to dim
+                    self.dim = True                                                         #       Flag that we're now dim
+                    logger.info('{} Display changed to DIM: {} (daytime dim)'.format(self.logPFX, nowTime))
+                if not (dimPassed and not brightPassed) and self.dim == True:               #       We are outside the window to be dim and the display is dim
+                    self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))    #       change to bright
+                    self.dim = False                                                        #       Flag that we're now bright
+                    logger.info('{} Display changed to BRIGHT: {} (daytime dim)'.format(self.logPFX, nowTime))
+        except Exception as e:
+            self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))
+            logger.error('{} Error Processing BRIGHT/DIM ({}) housekeeping: {}'.format(self.logPFX, self.dim, e))
+
+        if self.lastbright != config['display']['brtval'] and not self.dim:
+            self.nextionWrite('dim={}'.format(int(config['display']['brtval'])))
+        if self.lastdim != config['display']['dimval'] and self.dim:
+            self.nextionWrite('dim={}'.format(int(config['display']['dimval'])))
+
+    ### METAR UPDATE LOOP
+    # The METAR comes from the shared fetcher, _maxAge is how old its cached copy may be
+    def METARupdate(self, _maxAge=60):
+        logger.debug('{} METARupdate Loop Started: {}'.format(self.logPFX, self.fetcher.timebase.time()))
+        config = self.config
+        metar = 'uninitialized METAR'
+        mph = eval(config['system']['mph'])
+
+        currentDTime = self.localNow()
+
+        if self.online == True:
+            station = config['awos']['station']
+            metar = self.fetcher.metar(station, _maxAge)
+            warn = self.warn
+            statColor = white
+
+            # Configured station down or stale: show the closest nearby station that has a current report,
+            # in yellow on data.stat with the distance on the warning line
+            if self.fallback and metarMissing(metar, currentDTime):
+                nearest = self.fetcher.nearest(station, self.fallback, self.fallbackKm, _maxAge)
+                if nearest is not None:
+                    metar, km = nearest
+                    station = metar['icaoId']
+                    statColor = yellow
+                    warn = '\n'.join(line for line in ('{} OUT {:.0f}{}'.format(config['awos']['station'], km / 1.609344 if mph else km / 1.852, 'mi' if mph else 'nm'), self.warn) if line)
+                    FALLBACKS.inc()
+                    logger.warning('{} {} unavailable, showing {} {:.0f}km away'.format(self.logPFX, config['awos']['station'], station, km))
+
+            if type(metar) is dict:
+                #if self.metar_id != metar['icaoId']:
+                #    self.metar_id = metar['icaoId']
+                #if self.metar_id == metar['icaoId']:
+                logger.info('{} New METAR Received with ID {}'.format(self.logPFX, metar['icaoId']))
+
+                # Metar Time Conversion
+                metarRTime = mkDatetime(metar['reportTime'])
+                self.metarDTime = mkLocalTime(metarRTime, zones[config['system']['tz']])
+                metarTime = '{} {}'.format(friendlyT(self.metarDTime, friendlyDate), friendlyT(self.metarDTime, friendlyTimeZ))
+
+                # Render the whole data page in one write -- see DATA_PAGE for the component mapping
+                self.nextionSend(DATA_PAGE.render(metarRecord(metar, metarTime, mph, station, warn, statColor)))
+
+                # Log the METAR information
+                logger.debug('{} New Metar Processed at {}'.format(self.logPFX, metarTime))
+                logger.debug('    Station: {}'.format(metar['icaoId']))
+                logger.debug('    Wind Direction: {}'.format(metar.get('wdir')))
+                logger.debug('    Wind Speed: {}'.format(metar.get('wspd')))
+                logger.debug('    Wind Gusts: {}'.format(metar.get('wgst')))
+                logger.debug('    Temperature: {}C, {}F'.format(metar['temp'], ctof(metar['temp'])) if metar.get('temp') != None else None)
+                logger.debug('    Ceiling: {}'.format(metar.get('clouds', '')))
             else:
-                spd = ktom(metar['wgst'])
-            spd = ktom(spd) if eval(config['system']['mph']) == True else spd   # convert to MPH if configured -- eval turn text into boolean
-            nextionWrite('data.gust_g.val={}'.format((spd * 9)%360))            # gauge requires scaling * 9 to display
-            nextionWrite('data.gust.txt=\"{}\"'.format(spd))
-
-            # Temperature
-            ftmp = 'NA' if metar['temp'] == None else ctof(metar['temp'])            # convert to F and round
-            nextionWrite('data.temp_g.val={}'.format(0 if ftmp == 'NA' else ftmp*3)) # Gauge requires scaling * 3 to display
-            nextionWrite('data.temp.txt=\"{}\"'.format(ftmp))
-
-            # Dewpoint
-            ftmp = 'NA' if metar['dewp'] == None else ctof(metar['dewp'])            # convert to F and round
-            nextionWrite('data.dewp_g.val={}'.format(0 if ftmp == 'NA' else ftmp*3)) # Gauge requires scaling * 3 to display
-            nextionWrite('data.dewp.txt=\"{}\"'.format(ftmp))
-
-            # WXString
-            if 'wxString' not in metar: metar['wxString'] = 'NA'
-            nextionWrite('data.prcp.txt=\"{}\"'.format('' if metar['wxString'] == None else metar['wxString']))
-
-            # Visiblity
-            nextionWrite('data.vis.txt=\"{}\"'.format('' if metar['visib'] == None else str(metar['visib']) + ' mi'))
-
-            # Altimeter
-            alt = 'NA' if 'altim' not in metar else metar['altim']/33.864
-            nextionWrite('data.alt.txt=\"{}\"'.format(alt))
-
-            # Sky Condition
-            val = ''
-            if 'clouds' in metar:
-                for entry in metar['clouds']:
-                    val += '{} {}, '.format(entry['base'], entry['cover'])
-                val = 'data.sky.txt=\"{}{}'.format(val[:-2], '\"')
-            else:
-                metar['clouds'] = ''
-            nextionWrite(val)
-
-            # Warning/Alerts
-            nextionWrite('data.warn.txt=\"{}\"'.format(warn))
-
-            # Write station name in white b/c METAR is good.
-            nextionWrite('data.stat.txt=\"{}\"'.format(config['awos']['station']))
-            nextionWrite('data.stat.pco=65535')
-
-            # Log the METAR information
-            logger.debug('{} New Metar Processed at {}'.format(logPFX, metarTime))
-            logger.debug('    Station: {}'.format(metar['icaoId']))
-            logger.debug('    Wind Direction: {}'.format(metar['wdir']))
-            logger.debug('    Wind Speed: {}'.format(metar['wspd']))
-            logger.debug('    Wind Gusts: {}'.format(metar['wgst']))
-            logger.debug('    Temperature: {}C, {}F'.format(metar['temp'], round((metar['temp']*9/5)+32)) if metar['temp'] != None else None)
-            logger.debug('    Ceiling: {}'.format(metar['clouds']))
+                self.nextionSend(DATA_FAIL.render({'statColor': red, 'station': config['awos']['station'], 'warn': metar}))
+                logger.error('{} FAILED TO PARSE METAR: {}'.format(self.logPFX, metar))
+                self.metar_id = 0
         else:
-            nextionWrite('data.stat.pco={}'.format(red))
-            nextionWrite('data.stat.txt=\"{}\"'.format(config['awos']['station']))
-            nextionWrite('data.warn.txt=\"{}\"'.format(metar))
-            logger.error('{} FAILED TO PARSE METAR: {}'.format(logPFX, metar))
-            metar_id = 0
-    else:
-        logger.error('{} Network OFFLINE, cannot load metar'.format(logPFX))
-        metar_id = 0
+            logger.error('{} Network OFFLINE, cannot load metar'.format(self.logPFX))
+            self.metar_id = 0
+
+        # Change METAR time color based on METAR age
+        try:
+            if currentDTime > self.metarDTime + timedelta(hours=1):
+                self.nextionWrite('data.mtime.pco={}'.format(red))
+        except Exception as e:
+            self.nextionWrite('data.mtime.pco={}'.format(red))
+            logger.error('{} Missing METAR Time Processing METAR aging {} Exception: {}'.format(self.logPFX, metar, e))
+
+    # Upcoming conditions from the station's TAF into the warning field. Uses the TAF as last fetched
+    # unless _fetch is set (a new station was selected). Returns True if the warnings changed, they
+    # are shown with the next data page render.
+    def TAFupdate(self, _fetch=False):
+        if 'taf' not in self.fetcher.products:
+            return False
+        config = self.config
+        station = config['awos']['station']
+        taf = self.fetcher.get('taf', station) if _fetch and self.online else self.fetcher.cached('taf', station)
+        warn = tafWarnings(taf, self.fetcher.timebase.time(), zones[config['system']['tz']], eval(config['system']['mph']), self.tafHours) if type(taf) is dict else ''
+        if warn == self.warn:
+            return False
+        self.warn = warn
+        logger.info('{} TAF warnings for {}: {}'.format(self.logPFX, station, warn.replace('\n', ' / ') or 'none'))
+        return True
+
+    ### IN-SERVICE DISPLAY FIRMWARE UPDATE
+    # Log upload progress in 10% steps. The Nextion shows its own progress bar while in upload mode.
+    def firmwareProgress(self, _percent, _eta):
+        if _percent % 10 == 0:
+            logger.info('{} Display firmware upload {}%, ETA {}m{:02}s'.format(self.logPFX, _percent, _eta // 60, _eta % 60))
+
+    # Upload the TFT with Nexus, then find the display again at whatever baudrate the new firmware uses.
+    # Takes minutes, so flashFirmware() runs it on its own thread with the port closed and the display
+    # out of the loop; service() reopens the port and repaints everything afterwards. Sets and returns
+    # self.uploaded: True if uploaded, False if the display already ran this file, None if the upload failed.
+    def firmwareUpdate(self, _tftFile, _force=False):
+        from nexus import Nexus
+        logger.info('{} Display firmware update from {}'.format(self.logPFX, _tftFile))
+        baudrate = self.baudrate
+        uploaded = None
+        try:
+            nxu = Nexus(port=self.serialDevice, connectSpeed=baudrate, uploadSpeed=self.config.getint('system', 'tftbaud', fallback=0))
+            logger.info('{} Display {} serial {} firmware {} found at {} baud'.format(self.logPFX, nxu.model, nxu.serialNum, nxu.fwVersion, nxu.connectSpeed))
+            uploaded = nxu.upload(_tftFile, force=_force, progress=self.firmwareProgress)
+            nxu.ser.close()
+            logger.info('{} Display firmware {}'.format(self.logPFX, 'uploaded' if uploaded else 'already current, upload skipped'))
+        except Exception as e:
+            logger.error('{} Display firmware update failed: {}'.format(self.logPFX, e))
+
+        # The display reboots into the new firmware, give it a few tries to come back
+        device = None
+        for attempt in range(10):
+            nxu = Nexus(port=self.serialDevice, connectSpeed=baudrate, connect=False)
+            try:
+                device = nxu.connect()
+            except Exception as e:
+                logger.warning('{} Display reconnect attempt {} failed: {}'.format(self.logPFX, attempt + 1, e))
+            if device:
+                nxu.ser.close()
+                break
+            time.sleep(1)
+        if device:
+            self.baudrate = device.baudrate
+            logger.info('{} Display reconnected at {} baud'.format(self.logPFX, self.baudrate))
+        else:
+            logger.error('{} Display did not answer after firmware update, reopening at {} baud'.format(self.logPFX, self.baudrate))
+        self.uploaded = uploaded
+        return uploaded
+
+    # Apply a TFT file dropped at tftDrop, renamed by dropDone() afterwards so it is only applied once.
+    # Displays sharing a drop file all take it in the same housekeeping pass.
+    def checkFirmwareDrop(self):
+        drop = self.drops.get(self.tftDrop)
+        if drop is not None and self in drop['taken']:
+            return
+        if self.updating is None and os.path.exists(self.tftDrop) and tftComplete(self.tftDrop):
+            self.flashFirmware(self.tftDrop)
+
+    # This display is done with the drop file. The last display flashing it renames it, to .failed if any
+    # of their uploads failed.
+    def dropDone(self):
+        drop = self.drops[self.tftDrop]
+        drop['flashing'] -= 1
+        drop['failed'] = drop['failed'] or self.uploaded is None
+        if not drop['flashing']:
+            del self.drops[self.tftDrop]
+            os.replace(self.tftDrop, self.tftDrop + ('.failed' if drop['failed'] else '.done'))
+
+    # Close the port and start firmwareUpdate() on its own thread, the other displays carry on meanwhile
+    def flashFirmware(self, _tftFile, _force=False):
+        self.nextionWrite('page splash')
+        self.nextionWrite('splash.ipaddr.txt=\"Updating display\"')
+        self.writer.flush(10)
+        self.baudrate = self.ser.baudrate
+        self.ser.close()
+        self.tftFile = _tftFile
+        self.uploaded = None
+        if _tftFile == self.tftDrop:
+            drop = self.drops.setdefault(_tftFile, {'taken': set(), 'flashing': 0, 'failed': False})
+            drop['taken'].add(self)
+            drop['flashing'] += 1
+        self.updating = threading.Thread(target=self.firmwareUpdate, args=(_tftFile, _force), name='firmware-{}'.format(self.name), daemon=True)
+        self.updating.start()
+
+    ### CONFIG UPDATE ON DEMAND
+    def CFGupdate(self, _cmdStr):
+        if _cmdStr is None:
+            logger.info('CFGuptate called with type None argument, returning...')
+            return
+        config = self.config
+        logPFX = self.logPFX
+        nextionWrite = self.nextionWrite
+        cmd = _cmdStr[:3]
+        arg = _cmdStr[3:]
+        if cmd == 'STA':
+            config.set('awos', 'station', arg.upper())
+            nextionWrite('settings.station.txt=\"{}\"'.format(escape(config['awos']['station'])))
+            logger.info('{} New station selected: {}'.format(logPFX, config['awos']['station']))
+            self.writeConfig()
+            self.metar_id = 0
+            self.TAFupdate(True)
+
+        elif cmd == 'DIM':
+            hr = int(arg.split(':')[0])
+            if hr > 24:
+                logger.warning('{} Invalid DIM hour selected: {}; reverting to previous hour value: {}'.format(logPFX, hr, config['display']['dimhr']))
+                hr = config['display']['dimhr']
+            mn = int(arg.split(':')[1])
+            if mn > 59:
+                logger.warning('{} Invalid DIM minute selected: {}; reverting to previous minute value: {}'.format(logPFX, hr, config['display']['dimmin']))
+                mm = config['display']['dimmin']
+            config.set('display', 'dimhr', str(hr))
+            config.set('display', 'dimmin', str(mn))
+            nextionWrite('settings.dim_on.txt=\"{}:{:02d}\"'.format(hr, mn))
+            logger.info('{} New Display Dim time selected: {}:{:02d}'.format(logPFX, hr, mn))
+            self.writeConfig()
+
+        elif cmd == 'BRT':
+            hr = int(arg.split(':')[0])
+            if hr > 24:
+                logger.warning('{} Invalid BRIGHT hour selected: {}; reverting to previous hour value: {}'.format(logPFX, hr, config['display']['brthr']))
+                hr = config['display']['brthr']
+            mn = int(arg.split(':')[1])
+            if mn > 59:
+                logger.warning('{} Invalid BRIGHT minute selected: {}; reverting to previous minute value: {}'.format(logPFX, hr, config['display']['brtmin']))
+                mm = config['display']['brtmin']
+            config.set('display', 'brthr', str(hr))
+            config.set('display', 'brtmin', str(mn))
+            nextionWrite('settings.brt_on.txt=\"{}:{:02d}\"'.format(hr, mn))
+            logger.info('{} New Display Bright time selected: {}:{:02d}'.format(logPFX, hr, mn))
+            self.writeConfig()
+
+        elif cmd == 'DMV':
+            config.set('display', 'dimval', arg)
+            self.writeConfig()
+            logger.info('{} New display DIM value selected: {}'.format(logPFX, arg))
+
+        elif cmd == 'BRV':
+            config.set('display', 'brtval', arg)
+            self.writeConfig()
+            logger.info('{} New display BRIGHT value selected: {}'.format(logPFX, arg))
+
+        elif cmd == 'SPU':
+            if config['system']['mph'] == 'True':
+                config.set('system', 'mph', 'False')
+                nextionWrite('settings.spdunit.txt=\"KT\"')
+                nextionWrite('data.kt.aph=127')        # turn on KT
+                nextionWrite('data.mph.aph=0')         # turn off MPH
+            else:
+                config.set('system', 'mph', 'True')
+                nextionWrite('settings.spdunit.txt=\"MPH\"')
+                nextionWrite('data.mph.aph=127')       # turn on MPH
+                nextionWrite('data.kt.aph=0')          # turn off KT
+            self.writeConfig()
+            logger.info('{} New SPEED UNIT selected: {}'.format(logPFX, config['system']['mph']))
+            self.metar_id = 0
+
+        elif cmd == 'TZD':
+            config.set('system', 'tz', arg)
+            self.writeConfig()
+            logger.info('{} New Timezone selected: {}'.format(logPFX, arg))
+            self.metar_id = 0
+
+        elif cmd == 'TFT':
+            # Re-flash the display from the settings page: a dropped file if there is one, else the last one applied
+            tftFile = self.tftDrop if os.path.exists(self.tftDrop) else self.tftDrop + '.done'
+            if tftComplete(tftFile):
+                self.flashFirmware(tftFile, True)
+            else:
+                logger.warning('{} Display firmware update requested, but there is no TFT file at {}'.format(logPFX, self.tftDrop))
+
+        elif cmd == 'WFI':
+            tempSSID = config['wifi']['ssid']
+            tempPassword = config['wifi']['password']
+            logger.info('{} New WiFi network selected'.format(logPFX))
+            credentials = arg.split(':password:')
+
+            config.set('wifi','ssid', credentials[0])
+            config.set('wifi','password', credentials[1])
+            # Echo the credentials escaped like SETTINGS_PAGE does, a quote in them would break the command
+            nextionWrite('settings.ssid.txt=\"{}\"'.format(escape(config['wifi']['ssid'])))
+            nextionWrite('settings.password.txt=\"{}\"'.format(escape(config['wifi']['password'])))
+            logger.info('{} New WiFi credentials selected. SSID: {} Password: {}'.format(logPFX, config['wifi']['ssid'],config['wifi']['password']))
+
+            response = execute('sudo /usr/bin/nmcli dev wifi connect "{}" password "{}"'.format(config['wifi']['ssid'], config['wifi']['password']))
+            logger.info('{} EXEC: {}'.format(logPFX,response))
+            if config['wifi']['ssid'] != tempSSID:
+                response = execute('sudo /usr/bin/nmcli c delete "{}"'.format(tempSSID))
+                logger.info('{} EXEC: {}'.format(logPFX,response))
+            self.writeConfig()
+            self.lastOnline = False
+            self.checkOnline()
+            # Ensure we get a new METAR
+            self.metar_id = 0
 
-    # Change METAR time color based on METAR age
-    try:
-        if currentDTime > metarDTime + timedelta(hours=1):
-            nextionWrite('data.mtime.pco={}'.format(red))
-    except Exception as e:
-        nextionWrite('data.mtime.pco={}'.format(red))
-        logger.error('{} Missing METAR Time Processing METAR aging {} Exception: {}'.format(logPFX, metar, e))
- 
- ### 
-
-### CONFIG UPDATE ON DEMAND
-def CFGupdate(_cmdStr):
-    if type(_cmdStr) == None:
-        logger.info('CFGuptate called with type None argument, returning...')
-        return
-    global metar_id, online, lastOnline
-    cmd = _cmdStr[:3]
-    arg = _cmdStr[3:]
-    if cmd == 'STA':
-        config.set('awos', 'station', arg.upper())
-        nextionWrite('settings.station.txt=\"{}\"'.format(config['awos']['station']))
-        logger.info('{} New station selected: {}'.format(logPFX, config['awos']['station']))
-        writeConfig()
-        metar_id = 0
-    
-    elif cmd == 'DIM':
-        hr = int(arg.split(':')[0])
-        if hr > 24:
-            logger.warning('{} Invalid DIM hour selected: {}; reverting to previous hour value: {}'.format(logPFX, hr, config['display']['dimhr']))
-            hr = config['display']['dimhr']
-        mn = int(arg.split(':')[1])
-        if mn > 59:
-            logger.warning('{} Invalid DIM minute selected: {}; reverting to previous minute value: {}'.format(logPFX, hr, config['display']['dimmin']))
-            mm = config['display']['dimmin']
-        config.set('display', 'dimhr', str(hr))
-        config.set('display', 'dimmin', str(mn))
-        nextionWrite('settings.dim_on.txt=\"{}:{:02d}\"'.format(hr, mn))        
-        logger.info('{} New Display Dim time selected: {}:{:02d}'.format(logPFX, hr, mn))
-        writeConfig()
-
-    elif cmd == 'BRT':
-        hr = int(arg.split(':')[0])
-        if hr > 24:
-            logger.warning('{} Invalid BRIGHT hour selected: {}; reverting to previous hour value: {}'.format(logPFX, hr, config['display']['brthr']))
-            hr = config['display']['brthr']
-        mn = int(arg.split(':')[1])
-        if mn > 59:
-            logger.warning('{} Invalid BRIGHT minute selected: {}; reverting to previous minute value: {}'.format(logPFX, hr, config['display']['brtmin']))
-            mm = config['display']['brtmin']
-        config.set('display', 'brthr', str(hr))
-        config.set('display', 'brtmin', str(mn))
-        nextionWrite('settings.brt_on.txt=\"{}:{:02d}\"'.format(hr, mn))        
-        logger.info('{} New Display Bright time selected: {}:{:02d}'.format(logPFX, hr, mn))
-        writeConfig()
-
-    elif cmd == 'DMV':
-        config.set('display', 'dimval', arg)
-        writeConfig()
-        logger.info('{} New display DIM value selected: {}'.format(logPFX, arg))
-
-    elif cmd == 'BRV':
-        config.set('display', 'brtval', arg)
-        writeConfig()
-        logger.info('{} New display BRIGHT value selected: {}'.format(logPFX, arg))
-
-    elif cmd == 'SPU':
-        if config['system']['mph'] == 'True':
-            config.set('system', 'mph', 'False')
-            nextionWrite('settings.spdunit.txt=\"KT\"')
-            nextionWrite('data.kt.aph=127')        # turn on KT
-            nextionWrite('data.mph.aph=0')         # turn off MPH     
         else:
-            config.set('system', 'mph', 'True')
-            nextionWrite('settings.spdunit.txt=\"MPH\"')
-            nextionWrite('data.mph.aph=127')       # turn on MPH
-            nextionWrite('data.kt.aph=0')          # turn off KT
-        writeConfig()
-        logger.info('{} New SPEED UNIT selected: {}'.format(logPFX, config['system']['mph']))
-        metar_id = 0
- 
-    elif cmd == 'TZD':
-        config.set('system', 'tz', arg)
-        writeConfig()
-        logger.info('{} New Timezone selected: {}'.format(logPFX, arg))
-        metar_id = 0
-    
-    elif cmd == 'WFI':
-        tempSSID = config['wifi']['ssid']
-        tempPassword = config['wifi']['password']
-        logger.info('{} New WiFi network selected'.format(logPFX))
-        credentials = arg.split(':password:')
-  
-        config.set('wifi','ssid', credentials[0])
-        config.set('wifi','password', credentials[1])
-        nextionWrite('settings.ssid.txt=\"{}\"'.format(config['wifi']['ssid']))
-        nextionWrite('settings.password.txt=\"{}\"'.format(config['wifi']['password']))
-        logger.info('{} New WiFi credentials selected. SSID: {} Password: {}'.format(logPFX, config['wifi']['ssid'],config['wifi']['password']))
-
-        response = execute('sudo /usr/bin/nmcli dev wifi connect "{}" password "{}"'.format(config['wifi']['ssid'], config['wifi']['password']))
-        logger.info('{} EXEC: {}'.format(logPFX,response))     
-        if config['wifi']['ssid'] != tempSSID:
-            response = execute('sudo /usr/bin/nmcli c delete "{}"'.format(tempSSID))
-            logger.info('{} EXEC: {}'.format(logPFX,response))  
-        writeConfig()
-        lastOnline = False
-        checkOnline()
-        # Ensure we get a new METAR
-        metar_id = 0
-    
-    else:
-        logger.error('{} Unexpected (valid) string from Nextion: {}'.format(logPFX, repr(_cmdStr)))
-    
+            logger.error('{} Unexpected (valid) string from Nextion: {}'.format(logPFX, repr(_cmdStr)))
+
+
+#**** THESE ARE THE MAIN LOOPING FUNCTIONS. THE PROGRAM STAYS ****#
+#****     FOREVER ONCE THE CONFIGURAITON AND SETUP IS DONE    ****#
+# One scheduler drives every clock: housekeeping every 5s, one batched fetch per product for all
+# stations on the product's schedule, and settings page input from any display as soon as it arrives.
+# Displays are independent: one failing or being reflashed never holds up the others.
+class Scheduler:
+    def __init__(self, clocks, fetcher, statsFile='', statsInterval=60):
+        self.clocks        = clocks
+        self.fetcher       = fetcher
+        self.statsFile     = statsFile
+        self.statsInterval = statsInterval
+        self.timebase      = fetcher.timebase
+        self.lastUpdate    = 0
+        self.due           = dict.fromkeys(fetcher.products, 0)    # product: next scheduled fetch
+        self.prefetched    = False
+
+    # Run _work(clock) for every display in the loop. A display whose work raises (unplugged panel, port
+    # gone after a reflash) is taken out of the loop and retried, the other displays carry on.
+    def each(self, _work):
+        for clock in self.clocks:
+            if clock.active():
+                try:
+                    _work(clock)
+                except Exception as e:
+                    clock.fail(e)
+
+    # Start the first METAR fetch for all stations. start() does it if nobody did earlier, __main__ does it
+    # before starting the metrics and mirror servers so those overlap with the fetch too.
+    def prefetch(self):
+        if not self.prefetched:
+            self.prefetched = True
+            self.fetcher.prefetch([clock.config['awos']['station'] for clock in self.clocks])
+
+    # Bring up all displays. The first METAR fetch runs concurrently with the splash and settings
+    # initialization, each display switches to its data page as soon as the data is in. The other
+    # products are fetched on the first pass of the loop.
+    def start(self):
+        self.prefetch()
+        self.each(MetarClock.startup)
+        self.lastUpdate = self.timebase.time()
+        self.due['metar'] = self.lastUpdate + self.fetcher.products['metar'][1]
+
+    # Fetch _product for every online clock's station in one request, then let each clock show it.
+    # The next fetch is due after the product's TTL, or its retry interval if the fetch failed.
+    def fetchProduct(self, _product, _now):
+        url, ttl, retry = self.fetcher.products[_product]
+        ok = self.fetcher.refresh([clock.config['awos']['station'] for clock in self.clocks if clock.online and clock.active()], _product)
+        self.due[_product] = _now + (ttl if ok else retry)
+        self.each(lambda clock: self.showProduct(clock, _product))
+
+    def showProduct(self, _clock, _product):
+        if _product == 'metar':
+            _clock.TAFupdate()              # warnings move along with the clock even without a new TAF
+            _clock.METARupdate()
+        elif getattr(_clock, '{}update'.format(_product.upper()))():
+            _clock.METARupdate(self.fetcher.products['metar'][1])
+
+    # Settings page input from one display
+    def receive(self, _clock):
+        if _clock.ser.in_waiting:
+            cmdStr = _clock.serialReceive()
+            cfgStart = time.perf_counter()
+            _clock.CFGupdate(cmdStr)
+            CFG_TIME.observe(time.perf_counter() - cfgStart)
+            if _clock.active():             # not when a reflash just took the display over
+                _clock.housekeepingUpdate()
+                _clock.METARupdate()
+
+    def housekeeping(self, _clock):
+        _clock.housekeepingUpdate()
+        _clock.checkFirmwareDrop()
+
+    def run(self, _until=None):
+        lastStats = 0
+        while _until is None or self.timebase.time() < _until:
+            now = self.timebase.time()
+            if self.lastUpdate + 5 <= now:
+                if self.lastUpdate:
+                    HOUSE_LAG.observe(now - self.lastUpdate - 5)
+                self.each(self.housekeeping)
+                self.lastUpdate = now
+            for product, due in self.due.items():
+                if due <= now:
+                    if product == 'metar' and due:
+                        METAR_LAG.observe(now - due)
+                    self.fetchProduct(product, now)
+            self.each(self.receive)
+            for clock in self.clocks:
+                if not clock.active():
+                    try:
+                        clock.service(now)
+                    except Exception as e:
+                        clock.fail(e)
+            if self.statsFile and lastStats + self.statsInterval <= now:
+                try:
+                    metrics.writeStats(self.statsFile)
+                except Exception as e:
+                    logger.error('{} Could not write stats file {}: {}'.format(logPFX, self.statsFile, e))
+                lastStats = now
+            self.timebase.sleep(.5)     # Wait to run the loop again.
+
+### PROFILE MODE
+# Functions reported as pipeline stages in the profile report
+STAGES = ('housekeepingUpdate', 'METARupdate', 'TAFupdate', 'fetch', 'refresh', 'checkOnline', 'serialReceive',
+          'CFGupdate', 'nextionWrite', 'nextionSend', 'nextion_recover')
+
+# Run the live main loop under cProfile for _minutes, then write per-stage timings,
+# the hottest functions and the runtime metrics to _path
+def profileRun(_scheduler, _minutes, _path):
+    import io
+    import cProfile
+    import pstats
+    logger.info('{} Profiling main loop for {} minutes, report to {}'.format(logPFX, _minutes, _path))
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        _scheduler.run(_scheduler.timebase.time() + _minutes * 60)
+    except KeyboardInterrupt:
+        logger.info('{} Profile run interrupted, writing partial report'.format(logPFX))
+    finally:
+        profiler.disable()
+
+    report = io.StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    report.write('METAR Clock profile: {} minutes, {}\n\n'.format(_minutes, datetime.now().isoformat(timespec='seconds')))
+    report.write('{:<20} {:>8} {:>12} {:>12} {:>12}\n'.format('stage', 'calls', 'total s', 'own s', 'ms/call'))
+    for (filename, line, function), (cc, calls, own, total, callers) in sorted(stats.stats.items(), key=lambda item: -item[1][3]):
+        if function in STAGES and os.path.basename(filename) == os.path.basename(__file__):
+            report.write('{:<20} {:>8} {:>12.4f} {:>12.4f} {:>12.3f}\n'.format(function, calls, total, own, total / calls * 1000))
+    report.write('\n')
+    stats.sort_stats('cumulative').print_stats(40)
+    report.write(metrics.exposition())
+    with open(_path, mode='w') as reportFile:
+        reportFile.write(report.getvalue())
+    logger.info('{} Profile report written to {}'.format(logPFX, _path))
 
 
 if __name__ == '__main__':
@@ -587,56 +1211,64 @@ if __name__ == '__main__':
     # Added 2023-07-09 CTB
     metar ALL = NOPASSWD: /usr/bin/nmcli
     '''
-    
-    #**** PROGRAM VERSION ****#
-    __version__ = "3.0a"
+
+    argParser = argparse.ArgumentParser(description='METAR Clock for Nextion displays')
+    argParser.add_argument('-c', '--config', metavar='FILE', action='append',
+                           help='Configuration file of one display, repeat for every display driven by this process '
+                                '(default: /home/metar/metarclock/config.ini)')
+    argParser.add_argument('--profile', metavar='MINUTES', type=float, default=0,
+                           help='Run the live loop under cProfile for MINUTES, write a report and exit')
+    argParser.add_argument('--profile-out', metavar='FILE', default='metarclock-profile.txt',
+                           help='Where to write the --profile report (default: %(default)s)')
+    args = argParser.parse_args()
 
     #**** YOU WILL NEED TO CHANGE THESE THINGS ****#
-    # Things that are PLATFORM AND INSTALLATION SPECIFIC (ie SBC and/or OS and user)
-    serialDevice = '/dev/ttyS1'
-    netInterface = 'wlan0'
-    cfgFile = '/home/metar/metarclock/config.ini'
+    # The serial device and network interface of each display are set in its config file
+    cfgFiles = args.config or ['/home/metar/metarclock/config.ini']
 
     #**** SOME THINGS HERE COULD CHANGE -- LIKE THE LOG LEVEL AND IF YOU ****#
-    logPFX = '[METARClock V{}]'.format(__version__)
-    logger = logging.getLogger()
     logger.setLevel(logging.INFO)
     consoleHandler = logging.StreamHandler(sys.stdout)
     logger.addHandler(consoleHandler)
     logger.info('{}: Starting up'.format(logPFX))
 
-    # Read external configuration file
-    config = ConfigParser()
-    config.read(cfgFile)
-
-    ser = serial.Serial(
-      port=serialDevice,
-      baudrate = 115200,
-      parity = serial.PARITY_NONE,
-      stopbits = serial.STOPBITS_ONE,
-      bytesize = serial.EIGHTBITS,
-      timeout = 2 # timeout in reception in seconds
-    )
+    # Read external configuration files, the first one also holds the process wide settings
+    configs = []
+    for cfgFile in cfgFiles:
+        config = ConfigParser()
+        config.read(cfgFile)
+        configs.append(config)
+    config = configs[0]
+
+    # Products besides the METAR, an empty url turns one off
+    products = {}
+    tafUrl = config.get('taf', 'url', fallback=PRODUCTS['taf'][0])
+    if tafUrl:
+        products['taf'] = (tafUrl, config.getint('taf', 'ttl', fallback=PRODUCTS['taf'][1]), config.getint('taf', 'retry', fallback=PRODUCTS['taf'][2]))
+    fetcher = Fetcher(config['system']['url'], config.get('fallback', 'catalog', fallback=''), products)
+    clocks = [MetarClock(cfgFile, fetcher, config) for cfgFile, config in zip(cfgFiles, configs)]
+    scheduler = Scheduler(clocks, fetcher, config.get('metrics', 'statsfile', fallback=''), config.getint('metrics', 'interval', fallback=60))
+    scheduler.prefetch()
+
+    # Metrics endpoint and/or stats file, both optional
+    metricsPort = config.getint('metrics', 'port', fallback=0)
+    if metricsPort:
+        metrics.serve(metricsPort, config.get('metrics', 'host', fallback='127.0.0.1'))
+        logger.info('{} Metrics endpoint listening on port {}'.format(logPFX, metricsPort))
+    # Read-only web mirror of all displays, optional
+    mirrorPort = config.getint('mirror', 'port', fallback=0)
+    if mirrorPort:
+        from mirror import Mirror
+        mirror = Mirror()
+        mirror.serve(mirrorPort, config.get('mirror', 'host', fallback='127.0.0.1'))
+        for clock in clocks:
+            clock.mirror = mirror
+        logger.info('{} Display mirror listening on port {}'.format(logPFX, mirrorPort))
 
     # Configure serial port and other startup stuff
-    startup()
-
-    #**** THESE ARE THE MAIN LOOPING FUNCTIONS. THE PROGRAM STAYS ****#
-    #****     FOREVER ONCE THE CONFIGURAITON AND SETUP IS DONE    ****#
-    lastUpdate = 0
-    lastMETAR = 0
-    while True:
-        now = time.time()
-        if lastUpdate + 5 <= now:
-            housekeepingUpdate()
-            lastUpdate = now
-        if lastMETAR + 300 <= now: # or metar_id == 0:
-            METARupdate()             
-            lastMETAR = now
-        if ser.in_waiting:
-            CFGupdate(serialReceive())
-            housekeepingUpdate()
-            lastUpdate = now
-            METARupdate()
-            lastMETAR = now
-        time.sleep(.5)     # Wait to run the loop again.
+    scheduler.start()
+
+    if args.profile:
+        profileRun(scheduler, args.profile, args.profile_out)
+    else:
+        scheduler.run()
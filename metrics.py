@@ -0,0 +1,136 @@
+"""
+Runtime metrics for the METAR Clock.
+
+Counters, gauges and fixed-bucket histograms that are cheap enough to stay on in
+production: recording is a dict/list increment (plus a bisect for histograms)
+under a per-metric lock, as the writer, prefetch and catalog threads record into
+the same metrics as the main loop. All formatting happens only when the metrics
+are read. They are exposed in the
+Prometheus text format through a small local HTTP endpoint and/or a stats file
+that is rewritten periodically.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+
+REGISTRY = []
+
+# Latency buckets in seconds, from a serial write up to an HTTP timeout
+LATENCY = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Schedule lag buckets in seconds, the loop sleeps 0.5s between passes
+LAG = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(_name, _value):
+    return '{{{}="{}"}}'.format(_name, _value) if _name else ''
+
+
+class Counter:
+    def __init__(self, name, help, label=''):
+        self.name   = name
+        self.help   = help
+        self.label  = label
+        self.values = {}
+        self.lock   = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, _n=1, _label=''):
+        with self.lock:
+            self.values[_label] = self.values.get(_label, 0) + _n
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label, value in values:
+            lines.append('{}{} {}'.format(self.name, _labels(self.label, label), value))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help):
+        self.name  = name
+        self.help  = help
+        self.value = 0
+        REGISTRY.append(self)
+
+    def set(self, _value):
+        self.value = _value
+
+    def expose(self):
+        return ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} gauge'.format(self.name),
+                '{} {}'.format(self.name, self.value)]
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=LATENCY):
+        self.name    = name
+        self.help    = help
+        self.buckets = tuple(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)     # last slot is +Inf
+        self.sum     = 0.0
+        self.count   = 0
+        self.lock    = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, _value):
+        slot = bisect_left(self.buckets, _value)
+        with self.lock:
+            self.counts[slot] += 1
+            self.sum += _value
+            self.count += 1
+
+    def expose(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            counts, observed, count = list(self.counts), self.sum, self.count
+        total = 0
+        for bound, bucket in zip(self.buckets + ('+Inf',), counts):
+            total += bucket
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, total))
+        lines.append('{}_sum {}'.format(self.name, observed))
+        lines.append('{}_count {}'.format(self.name, count))
+        return lines
+
+
+# All registered metrics in the Prometheus text exposition format
+def exposition():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+# Write the exposition to a stats file. Written to a temp file and renamed so readers never see half a file.
+def writeStats(_path):
+    tmp = '{}.tmp'.format(_path)
+    with open(tmp, mode='w') as statsFile:
+        statsFile.write(exposition())
+    os.replace(tmp, _path)
+
+
+# Serve /metrics from a daemon thread so scrapes never touch the main loop. http.server is
+# imported here, it is slow to import and only needed when the endpoint is enabled.
+def serve(_port, _host='127.0.0.1'):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = exposition().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((_host, _port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,184 @@
+"""
+Read-only web mirror of what the METAR Clock displays show.
+
+Every command written to a Nextion is recorded as component -> value in one
+in-memory snapshot per display. Only real changes bump the version and are kept
+in a short change log. A small HTTP server on daemon threads publishes:
+
+    /          a live HTML view
+    /state     the full snapshot as JSON (encoded once per version, shared by all viewers)
+    /events    server-sent events: the snapshot once, then only the changes
+
+Recording happens after the serial write and never waits on a viewer, so it
+adds no latency to the display. Components listed in PRIVATE (the WiFi
+credentials on the settings page) are never recorded. The server listens on
+localhost unless configured otherwise and has no authentication.
+"""
+
+import re
+import json
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EndCom = b'\xff\xff\xff'
+
+# Escape sequences of render.escape(): \r is a line break, any other escaped character stands for itself
+ESCAPED  = re.compile(r'\\(.)', re.DOTALL)
+UNESCAPE = {'r': '\n'}
+
+# Seconds between SSE keepalive comments, keeps proxies from closing idle streams
+KEEPALIVE = 15
+
+# Components that are never mirrored
+PRIVATE = {'settings.ssid.txt', 'settings.password.txt'}
+
+
+# Undo the Nextion string escaping done by render.escape(), in one left to right pass so an escaped
+# backslash followed by 'r' stays a backslash and an 'r'
+def unescape(_text):
+    if '\\' not in _text:
+        return _text
+    return ESCAPED.sub(lambda m: UNESCAPE.get(m.group(1), m.group(1)), _text)
+
+
+class Mirror:
+    def __init__(self, history=1024):
+        self.cond     = threading.Condition()
+        self.state    = {}                          # display: {component: value}
+        self.version  = 0
+        self.changes  = deque(maxlen=history)       # (version, display, component, value)
+        self.snapshot = (-1, b'')                   # (version, encoded JSON) of the last /state
+
+    # Record one write to a display: any number of EndCom terminated commands
+    def record(self, _display, _data):
+        changed = []
+        for command in _data.split(EndCom):
+            if not command:
+                continue
+            command = command.decode('utf-8', 'replace')
+            component, sep, value = command.partition('=')
+            if not sep:
+                component, sep, value = command.partition(' ')      # page data, rest, ...
+            if component in PRIVATE:
+                continue
+            if value.startswith('"') and value.endswith('"') and len(value) > 1:
+                value = unescape(value[1:-1])
+            changed.append((component, value))
+        if not changed:
+            return
+        with self.cond:
+            state = self.state.setdefault(_display, {})
+            version = self.version
+            for component, value in changed:
+                if state.get(component) != value:
+                    state[component] = value
+                    version += 1
+                    self.changes.append((version, _display, component, value))
+            if version != self.version:
+                self.version = version
+                self.cond.notify_all()
+
+    # The full state as encoded JSON, rebuilt only when something changed since the last request
+    def encoded(self):
+        with self.cond:
+            if self.snapshot[0] != self.version:
+                self.snapshot = (self.version, json.dumps({'version': self.version, 'displays': self.state}).encode('utf-8'))
+            return self.snapshot
+
+    # Wait for changes after _version. Returns (version, changes), changes is None if the viewer fell
+    # too far behind the change log and needs a fresh snapshot.
+    def since(self, _version, _timeout):
+        with self.cond:
+            if self.version == _version:
+                self.cond.wait(_timeout)
+            if self.version == _version:
+                return _version, []
+            if not self.changes or self.changes[0][0] > _version + 1:
+                return self.version, None
+            return self.version, [change for change in self.changes if change[0] > _version]
+
+    # Serve the mirror from daemon threads, one per viewer
+    def serve(self, _port, _host='127.0.0.1'):
+        server = ThreadingHTTPServer((_host, _port), type('Handler', (MirrorHandler,), {'mirror': self}))
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='mirror', daemon=True).start()
+        return server
+
+
+PAGE = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>METAR Clock mirror</title>
+<style>body{font-family:sans-serif;background:#111;color:#eee}table{border-collapse:collapse;margin:1em 0}
+td{padding:2px 10px;border-bottom:1px solid #333}h2{margin-bottom:0}</style></head>
+<body><h1>METAR Clock mirror</h1><div id="displays"></div>
+<script>
+var state = {};
+function draw() {
+  var html = '';
+  Object.keys(state).sort().forEach(function (display) {
+    html += '<h2>' + display + '</h2><table>';
+    Object.keys(state[display]).sort().forEach(function (component) {
+      var cell = document.createElement('td');
+      cell.textContent = state[display][component];
+      html += '<tr><td>' + component + '</td>' + cell.outerHTML + '</tr>';
+    });
+    html += '</table>';
+  });
+  document.getElementById('displays').innerHTML = html;
+}
+var events = new EventSource('events');
+events.addEventListener('snapshot', function (e) { state = JSON.parse(e.data).displays; draw(); });
+events.addEventListener('change', function (e) {
+  JSON.parse(e.data).forEach(function (c) { (state[c[1]] = state[c[1]] || {})[c[2]] = c[3]; });
+  draw();
+});
+</script></body></html>
+'''
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    mirror = None
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/':
+            self.reply(PAGE, 'text/html; charset=utf-8')
+        elif path == '/state':
+            self.reply(self.mirror.encoded()[1], 'application/json')
+        elif path == '/events':
+            self.events()
+        else:
+            self.send_error(404)
+
+    def reply(self, _body, _type):
+        self.send_response(200)
+        self.send_header('Content-Type', _type)
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        try:
+            version, snapshot = self.mirror.encoded()
+            self.wfile.write(b'event: snapshot\ndata: ' + snapshot + b'\n\n')
+            self.wfile.flush()
+            while True:
+                version, changes = self.mirror.since(version, KEEPALIVE)
+                if changes is None:
+                    version, snapshot = self.mirror.encoded()
+                    self.wfile.write(b'event: snapshot\ndata: ' + snapshot + b'\n\n')
+                elif changes:
+                    data = json.dumps(changes).encode('utf-8')
+                    self.wfile.write(b'event: change\nid: ' + str(version).encode('ascii') + b'\ndata: ' + data + b'\n\n')
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
@@ -5,23 +5,72 @@ License, v. 2.0. If a copy of the MPL was not distributed with this
 file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 MODIFIED 2023-07-04 CTB -- remove port scanning b/c scanning is broken
+MODIFIED 2026-10-19 -- skip uploads a panel already runs, mmap reads, honour the panel's skip offset
+MODIFIED 2026-10-19 -- port scanning restored (pyserial hides on-board UARTs), ports probed in parallel,
+                       last working port/baudrate tried first, connect() returns a DeviceInfo
 """
 
 import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
 import struct
+import tempfile
 import time
+import threading
 import serial
-#from serial.tools.list_ports import comports as availablePorts
+from serial.tools.list_ports import comports
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from glob import glob
 from pathlib import Path
 from math import ceil
 
+logger = logging.getLogger(__name__)
+
+
+def availablePorts():
+    """All serial ports that could have a Nextion attached. pyserial's comports() leaves out on-board
+    (platform) UARTs such as /dev/ttyS1 on SBCs, which is what broke the original scanner, so those
+    are added from /dev."""
+    ports = [p.device for p in comports()]
+    for pattern in ("/dev/ttyS*", "/dev/ttyAMA*", "/dev/serial[0-9]"):
+        for device in sorted(glob(pattern)):
+            if device not in ports:
+                ports.append(device)
+    return ports
+
+
+@dataclass
+class DeviceInfo:
+    port:        str
+    baudrate:    int
+    touch:       bool
+    address:     int
+    model:       str
+    fwVersion:   int
+    mcuCode:     int
+    serialNum:   str
+    flashSize:   str
+
+    def __str__(self):
+        d = {"Port": self.port, "Baudrate": self.baudrate, "Model": self.model, "Flash Size": self.flashSize,
+             "Address": self.address, "Firmware Version": self.fwVersion, "MCU Code": self.mcuCode,
+             "Serial Number": self.serialNum}
+        maxLen = max([len(k) for k in d.keys()]) + 1
+        return "\n".join((k + ":").ljust(maxLen, " ") + " " + str(v) for k, v in d.items())
+
 
 class Nexus:
     NXEOL = b"\xff\xff\xff"
     NXACK = b"\x05"
     NXSKP = b"\x08"
+    # Held while the state file is read, changed and written back: one process may flash several panels at once
+    stateLock = threading.Lock()
 
-    def __init__(self, port="", uploadSpeed=0, connectSpeed=0, connect=True):
+    def __init__(self, port="", uploadSpeed=0, connectSpeed=0, connect=True, statePath=None):
         self.uploadSpeed  = uploadSpeed
         self.connectSpeed = connectSpeed
         self.connected    = False
@@ -32,12 +81,14 @@ class Nexus:
         self.mcuCode      = -1
         self.serialNum    = ""
         self.flashSizeStr = ""
-        self.ports        = port #['/dev/ttyS1'] #[p.device for p in availablePorts()]
-#        if port:
-#            if port not in self.ports:
-#                raise Exception("Specified port not available ({} not in {})".format(port, self.ports))
-#            else:
-#                self.ports = [port]
+        # Record of what was last flashed to each panel, keyed by serial number
+        self.statePath    = Path(statePath) if statePath else Path.home() / ".nexus.json"
+        self.device       = None
+        # A port name, a list of port names, or nothing to scan all available ports
+        if isinstance(port, str):
+            self.ports = [port] if port else []
+        else:
+            self.ports = list(port)
 
         self.ser  = serial.Serial()
         if connect:
@@ -45,6 +96,8 @@ class Nexus:
                 raise Exception("Cannot connect to device.")
 
     def connect(self):
+        """Find the display and return a DeviceInfo, or None if there is none. The port and baudrate of the
+        last successful connection are tried first, then all candidate ports are probed in parallel."""
         # Time to check baudrate is proportional to 1/baudrate. Therefore reversing the list leads on
         # average to a faster connection (with 115200 it is "instant" instead of ~1s).
         defaultSpeeds = [2400, 4800, 9600, 19200, 31250, 38400, 57600, 74880, 115200, 230400,
@@ -55,60 +108,96 @@ class Nexus:
                 defaultSpeeds.remove(self.connectSpeed)
             defaultSpeeds = [self.connectSpeed] + defaultSpeeds
 
-        for port in self.ports:
-            print("Scanning port " + port)
-            for speed in defaultSpeeds:
-                print("  at {}baud/s... ".format(speed), end="")
-                self.ser.close()
-                self.ser.port = port
-                self.ser.baudrate = speed
-                self.ser.timeout  = 1000/speed + 0.030
+        ports = self.ports or availablePorts()
+        found = threading.Event()
+        result = None
+
+        last = self.loadState().get("lastConnection")
+        if last and last["port"] in ports:
+            result = self.probe(last["port"], [last["baudrate"]], found)
+
+        if not result:
+            with ThreadPoolExecutor(max_workers=max(1, len(ports))) as pool:
+                probes = [pool.submit(self.probe, port, defaultSpeeds, found) for port in ports]
+                for probe in as_completed(probes):
+                    if probe.result() and not result:
+                        result = probe.result()
+                        found.set()
+            # A second display answering at the same moment is left alone
+            for probe in probes:
+                if probe.result() and probe.result() is not result:
+                    probe.result()[0].close()
+        if not result:
+            return None
+
+        self.ser, info = result
+        self.connected    = True
+        self.device       = info
+        self.touch        = info.touch
+        self.address      = info.address
+        self.model        = info.model
+        self.fwVersion    = info.fwVersion
+        self.mcuCode      = info.mcuCode
+        self.serialNum    = info.serialNum
+        self.flashSizeStr = info.flashSize
+        self.port         = info.port
+        self.connectSpeed = info.baudrate
+        if not self.uploadSpeed:
+            self.uploadSpeed = self.connectSpeed
+
+        try:
+            self.saveState(lastConnection={"port": info.port, "baudrate": info.baudrate})
+        except OSError:
+            pass
+        return info
+
+    def probe(self, port, speeds, found):
+        """Try the connect handshake on one port at the given speeds. Runs in its own thread with its own
+        serial object, gives up as soon as another port found the display. Returns (Serial, DeviceInfo), or None
+        if there is no display on this port. Never raises, a failing port must not abort the scan."""
+        ser = serial.Serial()
+        ser.port = port
+        try:
+            for speed in speeds:
+                if found.is_set():
+                    break
+                ser.close()
+                ser.baudrate = speed
+                ser.timeout  = 1000/speed + 0.030
                 try:
-                    self.ser.open()
-                except:
+                    ser.open()
+                except Exception:
                     break
-                self.ser.reset_input_buffer()
-                self.ser.write(b"DRAKJHSUYDGBNCJHGJKSHBDN\xff\xff\xffconnect\xff\xff\xff\xff\xffconnect\xff\xff\xff")
+                ser.reset_input_buffer()
+                ser.write(b"DRAKJHSUYDGBNCJHGJKSHBDN\xff\xff\xffconnect\xff\xff\xff\xff\xffconnect\xff\xff\xff")
                 data = b""
                 available = -1
                 while available != len(data):
-                    available = self.ser.in_waiting
-                    newData = self.ser.read_until(expected=self.NXEOL)
+                    available = ser.in_waiting
+                    newData = ser.read_until(expected=self.NXEOL)
                     if newData:
                         data = newData
                     else:
                         break
                 if not data.startswith(b"comok"):
-                    print("Failed (Got {}).".format(data))
                     continue
-                self.ser.write(self.NXEOL)
-                self.ser.read(42)
-                self.connected=True
+                ser.write(self.NXEOL)
+                ser.read(42)
                 data = data.lstrip(b"comok ").rstrip(self.NXEOL).split(b",")
                 data[1] = data[1].split(b"-")[1] # discard reserved part of argument 1
-                self.touch     = bool(int(data[0]))
-                self.address   = int(data[1])
-                self.model     = data[2].decode("ascii")
-                self.fwVersion = int(data[3])
-                self.mcuCode   = int(data[4])
-                self.serialNum = data[5].decode("ascii")
-                self.flashSizeStr = data[6].decode("ascii")
-                self.port         = port
-                self.connectSpeed = speed
-                if not self.model:
+                info = DeviceInfo(port=port, baudrate=speed, touch=bool(int(data[0])), address=int(data[1]),
+                                  model=data[2].decode("ascii"), fwVersion=int(data[3]), mcuCode=int(data[4]),
+                                  serialNum=data[5].decode("ascii"), flashSize=data[6].decode("ascii"))
+                if not info.model:
                     raise Exception("Invalid model! Data: {}".format(data))
-                if not self.uploadSpeed:
-                    self.uploadSpeed = self.connectSpeed
-                print("Success.\n")
-                d = {"Model": self.model, "Flash Size": self.flashSizeStr, "Address": self.address,
-                     "Firmware Version": self.fwVersion, "MCU Code": self.mcuCode, "Serial Number:": self.serialNum}
-                maxLen = max([len(k) for k in d.keys()]) + 1
-                for k,v in d.items():
-                    k += ":"
-                    print(k.ljust(maxLen, " "), v)
-                return True
-
-        return False
+                return ser, info
+        except Exception as e:
+            # Some other device on this port, or a garbled reply: this port is out, the others carry on
+            logger.warning("Probe of {} failed: {}".format(port, e))
+            ser.close()
+            return None
+        ser.close()
+        return None
 
     def sendCmd(self, cmd: str, *args):
         if not self.connected:
@@ -127,8 +216,6 @@ class Nexus:
         if not a:
             a = self.ser.read_until(self.NXACK)
         if not a.endswith(self.NXACK):
-            # Prevent overwriting of previous line
-            print("")
             raise Exception("Expected acknowledge ({}), got {}.".format(self.NXACK, a))
 
     def getFileSize(self, tftFilePath):
@@ -138,21 +225,61 @@ class Nexus:
         fileSize = struct.unpack("<I", rawSize)[0]
         return fileSize
 
-    def upload(self, tftFilePath):
-        # Visual separation in the console log
-        print("")
+    def loadState(self):
+        try:
+            with open(self.statePath) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"panels": {}}
+
+    def saveState(self, lastConnection=None, panel=None):
+        """Record the last working connection and/or this panel's upload record. The file is reloaded under
+        stateLock and written through a temp file of its own, so concurrent uploads to other panels keep
+        their records."""
+        with self.stateLock:
+            state = self.loadState()
+            if lastConnection is not None:
+                state["lastConnection"] = lastConnection
+            if panel is not None:
+                state.setdefault("panels", {})[self.serialNum] = panel
+            fd, tmp = tempfile.mkstemp(prefix=self.statePath.name + ".", suffix=".tmp", dir=self.statePath.parent)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f, indent=2)
+                os.replace(tmp, self.statePath)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def fileHash(self, tftFilePath):
+        with open(tftFilePath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return hashlib.sha256(m).hexdigest()
+
+    def upload(self, tftFilePath, force=False, progress=None):
+        """Upload a TFT file. Returns False if the panel already runs this exact file (and force is not
+        set), True once the upload completed. If given, progress(percent, etaSeconds) is called whenever
+        either changes. The upload always starts at byte 0, data is only skipped when the panel itself asks
+        for it with a 0x08 offset. Reports through the module logger, never prints."""
         if not self.connected:
             raise Exception("Successful connection required for upload.")
 
         fileSize = self.getFileSize(tftFilePath)
+        digest   = self.fileHash(tftFilePath)
+        record   = self.loadState().get("panels", {}).get(self.serialNum) if self.serialNum else None
+        if record and record["sha256"] == digest and record["complete"] and not force:
+            logger.info("Panel {} already runs {} ({}), skipping upload.".format(self.serialNum, Path(tftFilePath).name, digest[:12]))
+            return False
+        # Recorded as incomplete until the last block is acknowledged, so an interrupted upload is never skipped
+        record = {"sha256": digest, "file": Path(tftFilePath).name, "size": fileSize, "complete": False,
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        if self.serialNum:
+            self.saveState(panel=record)
 
         self.sendCmd("bs=42") # For some reason the first command after self.connect() always fails. Can be anything.
         self.sendCmd("dims=100")
         self.sendCmd("sleep=0")
         self.ser.reset_input_buffer()
 
-        print("Initiating upload... ", end="")
-
         # TODO: The firmware versions stupidly differ from series to series. A.k.a. 126 is fine
         #       for the basic series but not for the enhanced or intelligent series. grrr...
         #       more testing needed.
@@ -167,7 +294,7 @@ class Nexus:
         cmd = "whmi-wris"
         #if self.fwVersion < 126:
         #    cmd = "whmi-wri"
-        #    print("\nFirmware doesn't support upload protocol v1.2, using v1.1 instead.")
+        #    logger.info("Firmware doesn't support upload protocol v1.2, using v1.1 instead.")
         self.sendCmd(cmd, fileSize, self.uploadSpeed, 1)
         self.ser.close()
         self.ser.baudrate = self.uploadSpeed
@@ -177,15 +304,17 @@ class Nexus:
         except:
             raise Exception("Cannot reopen port at upload baudrate.")
         self.ack()
-        print("Success.")
+        logger.info("Upload of {} ({} bytes) initiated.".format(Path(tftFilePath).name, fileSize))
 
         blockSize = 4096
         remainingBlocks = ceil(fileSize / blockSize)
         blocksSent, lastProgress, lastEta = 0, 0, 0
-        with open(tftFilePath, "rb") as f:
+        pos = 0
+        with open(tftFilePath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
             startTime = time.time()
             while remainingBlocks:
-                self.ser.write(f.read(blockSize))
+                self.ser.write(m[pos:pos + blockSize])
+                pos = min(pos + blockSize, fileSize)
                 remainingBlocks -= 1
                 blocksSent += 1
 
@@ -197,21 +326,27 @@ class Nexus:
                     offset = struct.unpack("<I", offset)[0]
                     if (offset):
                         # A value of 0 doesn't mean "seek to position 0" but "don't seek anywhere".
-                        jumpSize = offset - f.tell()
-                        f.seek(offset)
+                        # Otherwise the panel asks to continue from the data it already holds.
+                        jumpSize = offset - pos
+                        pos = offset
                         remainingBlocks = ceil((fileSize - offset) / blockSize)
-                        print("Skipped {} bytes.".format(jumpSize))
+                        logger.info("Skipped {} bytes.".format(jumpSize))
                 else:
                     self.ack(proceed)
 
-                progress = 100 * f.tell() // fileSize
+                percent = 100 * pos // fileSize
                 eta = ceil((time.time() - startTime) / blocksSent * remainingBlocks)
-                if progress != lastProgress or eta != lastEta:
+                if percent != lastProgress or eta != lastEta:
                     lastEta = eta
-                    lastProgress = progress
-                    eta = "{}m{:02}s".format(eta // 60, eta % 60)
-                    print("Progress: {}%  ETA: {}".format(progress, eta), end="\r")
+                    lastProgress = percent
+                    if progress:
+                        progress(percent, eta)
 
+        record["complete"] = True
+        if self.serialNum:
+            self.saveState(panel=record)
+        logger.info("Upload of {} complete.".format(Path(tftFilePath).name))
+        return True
 
 if __name__ == "__main__":
     desc = """Nexus - Nextion Upload Script
@@ -225,7 +360,7 @@ if __name__ == "__main__":
     group.add_argument("-i", "--input", metavar="TFT_FILE", type=str,
                         help="Path to the TFT file")
     parser.add_argument("-p", "--port", metavar="PORT", type=str, default="",
-                        help="Specify serial port to use. Mandatory, original port scanner broken 2023-07-04 CTB")
+                        help="Specify serial port to use. If not given, all available ports are scanned.")
     parser.add_argument("-c", "--connect", metavar="BAUDRATE", type=int, required=False, default=0,
                         help="Preferred baudrate for the initial connection to the screen. If a connection at this "
                              "baudrate fails or if this argument is not given the script will try a list "
@@ -233,26 +368,28 @@ if __name__ == "__main__":
     parser.add_argument("-u", "--upload", metavar="BAUDRATE", type=int, required=False, default=0,
                         help="Optional baudrate for the actual upload. If not specified, the baudrate at which the "
                              "connection has been established will be used for the upload, too (can be slow!).")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="Upload even if the panel already runs this exact TFT file.")
+    parser.add_argument("-s", "--state", metavar="FILE", type=str, default=None,
+                        help="File recording what was last flashed to each panel (default: ~/.nexus.json).")
 
     args = parser.parse_args()
-    ports = [] #[p.device for p in availablePorts()]
-#    portsStr = ", ".join(ports)
-#    if args.list:
-#        print("List of available serial ports:")
-#        print(portsStr)
-#        exit()
-
-#    ports.append("")
-#    if args.port not in ports:
-#        parser.error("Port {} not found among the available ports: {}.".format(args.port, portsStr))
-    print(args.port)
-    ports.append(args.port)
-    print(ports)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.list:
+        print("List of available serial ports:")
+        print(", ".join(availablePorts()))
+        exit()
 
     tftPath = Path(args.input)
     if not tftPath.exists():
         parser.error("Invalid source file!")
 
-#    nxu = Nexus(port=args.port, connectSpeed=args.connect, uploadSpeed=args.upload)
-    nxu = Nexus(port=ports, connectSpeed=args.connect, uploadSpeed=args.upload)
-    nxu.upload(tftPath)
+    print("Scanning {}...".format(args.port if args.port else "all serial ports"))
+    nxu = Nexus(port=args.port, connectSpeed=args.connect, uploadSpeed=args.upload, statePath=args.state)
+    print("Success.\n")
+    print(nxu.device)
+    # One progress line, rewritten in place until the upload is done
+    def showProgress(percent, eta):
+        print("Progress: {}%  ETA: {}m{:02}s".format(percent, eta // 60, eta % 60), end="\n" if percent == 100 else "\r", flush=True)
+
+    nxu.upload(tftPath, force=args.force, progress=showProgress)
@@ -0,0 +1,89 @@
+"""
+Precompiled Nextion render templates for the METAR Clock.
+
+A template is declared as a table of rows, one per Nextion component:
+
+    (component, field, formatter[, scale])
+
+component  Nextion object and attribute, e.g. 'data.temp.txt' or 'data.temp_g.val'
+field      key in the record dict handed to render()
+formatter  callable turning the (scaled) value into the string shown on the panel
+scale      optional callable applied to the raw value first, skipped for None
+
+Tables are compiled once into pre-encoded byte prefixes and suffixes so a render
+is only the value encoding plus a single buffer join. String attributes (.txt)
+are quoted and escaped, everything else is sent bare.
+"""
+
+EndCom = b'\xff\xff\xff'
+
+
+# Make a string safe to place inside a Nextion "..." literal. Backslashes and
+# quotes are escaped, line breaks become the Nextion \r sequence.
+def escape(_text):
+    if '\\' in _text:
+        _text = _text.replace('\\', '\\\\')
+    if '"' in _text:
+        _text = _text.replace('"', '\\"')
+    if '\n' in _text:
+        _text = _text.replace('\r\n', '\\r').replace('\n', '\\r')
+    return _text
+
+
+### Formatters
+# Integer value for .val/.pco attributes. None and non-numeric values ('VRB' wind) become 0.
+def number(_value):
+    try:
+        return str(int(_value))
+    except (TypeError, ValueError):
+        return '0'
+
+# Text formatter factory: _none is shown for None, _format is applied otherwise
+def text(_none='', _format='{}'):
+    def _text(_value):
+        return _none if _value is None else _format.format(_value)
+    return _text
+
+
+### Scalings
+# Wind gauges need scaling * 9 to display, wrapped to a full circle
+def gauge(_value):
+    return (_value * 9) % 360
+
+# Temperature gauges need scaling * 3 to display
+def thermo(_value):
+    return _value * 3
+
+
+class Template:
+    def __init__(self, _table):
+        self.rows = []
+        for row in _table:
+            component, field, formatter = row[:3]
+            scale = row[3] if len(row) > 3 else None
+            if component.endswith('.txt'):
+                prefix = '{}="'.format(component).encode('utf-8')
+                suffix = b'"' + EndCom
+                quoted = True
+            else:
+                prefix = '{}='.format(component).encode('utf-8')
+                suffix = EndCom
+                quoted = False
+            self.rows.append((field, formatter, scale, quoted, prefix, suffix))
+        self.rows = tuple(self.rows)
+
+    # Render a record into one buffer of complete, EndCom terminated Nextion commands
+    def render(self, _record):
+        out = []
+        append = out.append
+        for field, formatter, scale, quoted, prefix, suffix in self.rows:
+            value = _record[field]
+            if scale is not None and value is not None:
+                value = scale(value)
+            value = formatter(value)
+            if quoted:
+                value = escape(value)
+            append(prefix)
+            append(value.encode('utf-8'))
+            append(suffix)
+        return b''.join(out)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+'''
+METAR Clock soak test. Runs the real main loop (Scheduler, METARupdate, TAF
+warnings, housekeeping, logging, metrics, mirror) on simulated time against a
+fake AWC and a fake serial port, so weeks of operation take minutes, and checks:
+
+    memory      tracemalloc and RSS, sampled every simulated 6 hours. Growth after
+                the warmup is flagged together with the allocations responsible.
+    timing      lateness of every scheduled fetch and the number of METAR cycles
+                against the TTL, and CPU time per simulated day (a loop that gets
+                slower the longer it runs is leaking work).
+    dim/bright  every dim/bright change against the configured local times, day
+                by day, across DST changes.
+
+    python soak.py                                  # 21 days from 2026-02-25, across the March DST change
+    python soak.py --start 2026-10-20 --dim 1:30    # across the November change, dimming in the repeated hour
+    python soak.py --days 60 --tz et --no-tracemalloc
+
+Exits 1 if anything was flagged.
+'''
+
+import os
+import sys
+import math
+import time
+import logging
+import atexit
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+
+import metarclock as mc
+from mirror import Mirror
+from timebase import SimulatedTime
+from bench import sampleConfig, FeedSerial
+
+SAMPLE_HOURS = 6                # memory and CPU sampling interval, simulated
+OUTAGE_EVERY = 97               # every n-th AWC request fails
+TOLERANCE    = 6                # seconds a dim/bright change may come after its time: housekeeping runs every 5s
+
+
+### FAKE AWC
+# Answers every request from the simulated time: a METAR observed at :53 past each hour and a TAF
+# issued every 6 hours with a thunderstorm period in it. Every OUTAGE_EVERY-th request fails.
+class FakeAWC(mc.Fetcher):
+    def __init__(self, url, products, timebase):
+        super().__init__(url, '', products, timebase)
+        self.requests = 0
+
+    def fetch(self, _url):
+        self.requests += 1
+        if self.requests % OUTAGE_EVERY == 0:
+            return 'URL Unreachable'
+        stations = parse_qs(urlsplit(_url).query)['ids'][0].split(',')
+        now = self.timebase.time()
+        if '/taf?' in _url:
+            return [self.taf(station, now) for station in stations]
+        return [self.metar(station, now) for station in stations]
+
+    def metar(self, _station, _now):
+        observed = (_now - 3180) // 3600 * 3600 + 3180
+        swing = math.sin(observed / 7200)
+        return {
+            'icaoId': _station, 'reportTime': datetime.fromtimestamp(observed, mc.zones['ut']).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'wdir': int(observed / 3600) * 10 % 360, 'wspd': int(10 + 8 * swing), 'wgst': int(20 + 10 * swing) if swing > 0 else None,
+            'temp': round(10 + 12 * swing, 1), 'dewp': round(4 + 6 * swing, 1), 'wxString': '-RA' if swing > 0.8 else None,
+            'visib': '10+', 'altim': round(1013 + 10 * swing, 1),
+            'clouds': [{'cover': 'BKN', 'base': int(2000 + 1500 * swing) // 100 * 100}],
+        }
+
+    def taf(self, _station, _now):
+        issued = _now // 21600 * 21600
+        fcsts = []
+        for period in range(4):
+            start = issued + period * 21600
+            fcsts.append({'timeFrom': start, 'timeTo': start + 21600, 'fcstChange': 'FM' if period else None,
+                          'wdir': 200, 'wspd': 12 + 4 * period, 'wgst': 25 + 4 * period if period % 2 else None,
+                          'visib': 3 if period == 2 else '6+', 'wxString': 'TSRA' if period == 2 else None,
+                          'clouds': [{'cover': 'OVC' if period == 2 else 'SCT', 'base': 900 if period == 2 else 5000}]})
+        return {'icaoId': _station, 'issueTime': datetime.fromtimestamp(issued, mc.zones['ut']).isoformat(), 'fcsts': fcsts}
+
+
+### FAKE SERIAL PORT
+# Takes touch input from the harness and keeps a log of dim/bright changes
+class SoakSerial(FeedSerial):
+    def __init__(self, timebase):
+        super().__init__()
+        self.timebase = timebase
+        self.dimValue = None
+        self.changes  = []          # (time, dim value)
+
+    def write(self, _data):
+        if b'dim=' in _data:
+            for command in _data.split(mc.EndCom):
+                if command.startswith(b'dim='):
+                    value = int(command[4:])
+                    if self.dimValue is not None and value != self.dimValue:
+                        self.changes.append((self.timebase.time(), value))
+                    self.dimValue = value
+        return super().write(_data)
+
+
+# Records how late each scheduled fetch starts
+class SoakScheduler(mc.Scheduler):
+    def __init__(self, clocks, fetcher, statsFile):
+        super().__init__(clocks, fetcher, statsFile)
+        self.cycles = dict.fromkeys(fetcher.products, 0)
+        self.late   = dict.fromkeys(fetcher.products, 0.0)
+
+    def fetchProduct(self, _product, _now):
+        if self.due[_product]:
+            self.late[_product] = max(self.late[_product], _now - self.due[_product])
+        self.cycles[_product] += 1
+        super().fetchProduct(_product, _now)
+
+
+### DIM/BRIGHT EXPECTATIONS
+# The first instant of _day at which the local wall clock shows _hour:_minute or later. A time skipped
+# by a spring-forward change is reached when the clocks jump, a repeated one at its first occurrence.
+def wallInstant(_day, _hour, _minute, _tz):
+    local = datetime(_day.year, _day.month, _day.day, _hour, _minute)
+    t = local.replace(tzinfo=_tz).timestamp()
+    if datetime.fromtimestamp(t, _tz).replace(tzinfo=None) == local:
+        return t
+    lo, hi = local.replace(tzinfo=_tz, fold=1).timestamp(), t
+    while hi - lo > 1:
+        mid = (lo + hi) / 2
+        if datetime.fromtimestamp(mid, _tz).replace(tzinfo=None) >= local:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
+# Every dim/bright change due between _start and _end: [(time, value), ...]
+def expectedChanges(_start, _end, _tz, _config):
+    display = _config['display']
+    times = ((int(display['dimhr']), int(display['dimmin']), int(display['dimval'])),
+             (int(display['brthr']), int(display['brtmin']), int(display['brtval'])))
+    expected = []
+    day = datetime.fromtimestamp(_start, _tz).date()
+    while day <= datetime.fromtimestamp(_end, _tz).date():
+        for hour, minute, value in times:
+            t = wallInstant(day, hour, minute, _tz)
+            if _start < t <= _end:
+                expected.append((t, value))
+        day += timedelta(days=1)
+    return sorted(expected)
+
+
+# Observed changes against the expected ones: (missed, unexpected)
+def checkChanges(_observed, _expected):
+    unmatched = list(_observed)
+    missed = []
+    for t, value in _expected:
+        match = next((change for change in unmatched if change[1] == value and t <= change[0] <= t + TOLERANCE), None)
+        if match is None:
+            missed.append((t, value))
+        else:
+            unmatched.remove(match)
+    return missed, unmatched
+
+
+def rssKiB():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def hhmm(_value):
+    hour, minute = _value.split(':')
+    return str(int(hour)), str(int(minute))
+
+
+if __name__ == '__main__':
+    argParser = argparse.ArgumentParser(description='METAR Clock accelerated-time soak test')
+    argParser.add_argument('--days', type=float, default=21, help='Simulated days to run (default: %(default)s)')
+    argParser.add_argument('--start', default='2026-02-25', help='Simulated start date, noon local time (default: %(default)s)')
+    argParser.add_argument('--tz', default='ct', choices=sorted(mc.zones), help='Display timezone (default: %(default)s)')
+    argParser.add_argument('--dim', metavar='HH:MM', help='Dim time (default: from config.ini.sample)')
+    argParser.add_argument('--bright', metavar='HH:MM', help='Bright time (default: from config.ini.sample)')
+    argParser.add_argument('--warmup', type=float, default=1, help='Simulated days before memory is baselined (default: %(default)s)')
+    argParser.add_argument('--max-growth', type=int, default=256, metavar='KIB',
+                           help='Flag traced memory growth after the warmup above this (default: %(default)s)')
+    argParser.add_argument('--max-rss-growth', type=int, default=4096, metavar='KIB',
+                           help='Flag RSS growth after the warmup above this (default: %(default)s)')
+    argParser.add_argument('--no-tracemalloc', action='store_true', help='Only watch RSS, runs about twice as fast')
+    args = argParser.parse_args()
+
+    workDir = tempfile.mkdtemp(prefix='metarclock-soak-')
+    atexit.register(shutil.rmtree, workDir, True)
+    cfgFile = os.path.join(workDir, 'config.ini')
+    config = sampleConfig()
+    config.set('system', 'interface', 'lo')
+    config.set('system', 'tz', args.tz)
+    config.set('system', 'tftdrop', os.path.join(workDir, 'update.tft'))
+    if args.dim:
+        config.set('display', 'dimhr', hhmm(args.dim)[0])
+        config.set('display', 'dimmin', hhmm(args.dim)[1])
+    if args.bright:
+        config.set('display', 'brthr', hhmm(args.bright)[0])
+        config.set('display', 'brtmin', hhmm(args.bright)[1])
+    with open(cfgFile, mode='w') as f:
+        config.write(f)
+
+    # The logging, metrics and mirror paths all run, output goes nowhere
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler(open(os.devnull, mode='w')))
+
+    tz = mc.zones[args.tz]
+    start = datetime.fromisoformat(args.start).replace(hour=12, tzinfo=tz).timestamp()
+    timebase = SimulatedTime(start)
+    fetcher = FakeAWC(config['system']['url'], {'taf': mc.PRODUCTS['taf']}, timebase)
+    ser = SoakSerial(timebase)
+    clock = mc.MetarClock(cfgFile, fetcher, config, ser)
+    clock.mirror = Mirror()
+    scheduler = SoakScheduler([clock], fetcher, os.path.join(workDir, 'stats.prom'))
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+    scheduler.start()
+    loopStart = timebase.time()
+    end = start + args.days * 86400
+    warmupEnd = start + args.warmup * 86400
+    samples = []                    # (simulated time, RSS KiB, traced KiB, CPU seconds of the chunk)
+    baseline = None
+    wallStart = time.perf_counter()
+    t = start
+    touches = 0
+    while t < end:
+        t = min(t + SAMPLE_HOURS * 3600, end)
+        chunkStart = time.process_time()
+        scheduler.run(t)
+        cpu = time.process_time() - chunkStart
+        traced = tracemalloc.get_traced_memory()[0] // 1024 if tracemalloc.is_tracing() else 0
+        samples.append((t, rssKiB(), traced, cpu))
+        if baseline is None and t >= warmupEnd and tracemalloc.is_tracing():
+            baseline = tracemalloc.take_snapshot().filter_traces(ignore)
+        # Someone at the settings page: select the station again, which writes the config file
+        touches += 1
+        ser.feed('STA{}'.format(config['awos']['station']).encode('ascii') + mc.EndCom)
+        print('\r{:%Y-%m-%d %H:%M %Z}  RSS {:>7} KiB  traced {:>6} KiB'.format(datetime.fromtimestamp(t, tz), samples[-1][1], traced),
+              end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    wall = time.perf_counter() - wallStart
+
+    flags = []
+    days = (end - start) / 86400
+    print('Simulated {:.1f} days in {:.0f}s ({:.0f}x), {} AWC requests, {} touch inputs'.format(days, wall, days * 86400 / wall, fetcher.requests, touches))
+
+    # Memory
+    after = [sample for sample in samples if sample[0] >= warmupEnd]
+    if len(after) >= 2:
+        rssGrowth = after[-1][1] - after[0][1]
+        print('RSS            {} KiB -> {} KiB after warmup ({:+} KiB)'.format(after[0][1], after[-1][1], rssGrowth))
+        if rssGrowth > args.max_rss_growth:
+            flags.append('RSS grew {} KiB'.format(rssGrowth))
+        if baseline is not None:
+            final = tracemalloc.take_snapshot().filter_traces(ignore)
+            growth = sum(stat.size_diff for stat in final.compare_to(baseline, 'filename')) // 1024
+            print('traced memory  {} KiB -> {} KiB after warmup ({:+} KiB)'.format(after[0][2], after[-1][2], growth))
+            if growth > args.max_growth:
+                flags.append('traced memory grew {} KiB'.format(growth))
+                print('  largest growth:')
+                for stat in final.compare_to(baseline, 'lineno')[:10]:
+                    if stat.size_diff > 0:
+                        print('    {:+8} KiB {:+7} blocks  {}'.format(stat.size_diff // 1024, stat.count_diff, stat.traceback))
+    else:
+        print('Run too short to check memory after a {} day warmup'.format(args.warmup))
+
+    # Timing
+    for product, (url, ttl, retry) in fetcher.products.items():
+        print('{:<14} {} fetches, at most {:.1f}s late'.format(product.upper(), scheduler.cycles[product], scheduler.late[product]))
+        if scheduler.late[product] > 1:
+            flags.append('{} fetches up to {:.1f}s late'.format(product.upper(), scheduler.late[product]))
+    expectedCycles = int((end - loopStart) // fetcher.products['metar'][1])
+    if abs(scheduler.cycles['metar'] - expectedCycles) > 1:
+        flags.append('{} METAR cycles, expected {}'.format(scheduler.cycles['metar'], expectedCycles))
+    perDay = {}
+    for t, rss, traced, cpu in samples:
+        perDay.setdefault(int((t - start - 1) // 86400), []).append(cpu)
+    daily = [sum(cpus) for day, cpus in sorted(perDay.items()) if len(cpus) == 24 // SAMPLE_HOURS]
+    if len(daily) >= 4:
+        early, late = sum(daily[1:3]) / 2, sum(daily[-2:]) / 2
+        print('CPU per day    {:.2f}s early, {:.2f}s late ({:.2f}x)'.format(early, late, late / early))
+        if late > early * 1.5:
+            flags.append('CPU per simulated day went from {:.2f}s to {:.2f}s'.format(early, late))
+
+    # Dim/bright
+    missed, unexpected = checkChanges(ser.changes, expectedChanges(start, end, tz, config))
+    print('dim/bright     {} changes, {} missed, {} unexpected'.format(len(ser.changes), len(missed), len(unexpected)))
+    dimval = int(config['display']['dimval'])
+    for label, changes in (('missed', missed), ('unexpected', unexpected)):
+        for t, value in changes:
+            print('  {:<10} {} at {:%Y-%m-%d %H:%M:%S %Z}'.format(label, 'DIM' if value == dimval else 'BRIGHT', datetime.fromtimestamp(t, tz)))
+    if missed or unexpected:
+        flags.append('{} missed and {} unexpected dim/bright changes'.format(len(missed), len(unexpected)))
+
+    for flag in flags:
+        print('FLAG: {}'.format(flag))
+    print('OK' if not flags else 'FAILED')
+    sys.exit(1 if flags else 0)
@@ -0,0 +1,124 @@
+"""
+Station catalog and spatial index for the nearest-station fallback.
+
+The AWC station list (ICAO id, lat/lon of every station that reports METARs) is
+cached locally as a compact JSON file and refreshed when it gets old. Stations
+are indexed on a grid over their unit vectors (x, y, z on the sphere), so there
+is no longitude wrap or pole to special-case: a lookup visits the grid cells in
+growing shells around the query point and stops as soon as no unvisited cell
+can hold anything closer than the k-th station found.
+"""
+
+import os
+import json
+import math
+import time
+
+CATALOG_URL = 'https://aviationweather.gov/data/cache/stations.cache.json.gz'
+EARTH_KM    = 6371.0
+CELL_KM     = 100                   # grid cell edge, about the spacing of reporting stations
+
+
+def unitVector(_lat, _lon):
+    lat = math.radians(_lat)
+    lon = math.radians(_lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+
+# Great circle distance in km from the straight line (chord) distance between two unit vectors
+def chordKm(_chord):
+    return 2 * EARTH_KM * math.asin(min(1.0, _chord / 2))
+
+
+def kmChord(_km):
+    return 2 * math.sin(min(math.pi, _km / EARTH_KM) / 2)
+
+
+# Offsets of the cells exactly _ring cells away from the centre cell
+def shell(_ring):
+    span = range(-_ring, _ring + 1)
+    return tuple((dx, dy, dz) for dx in span for dy in span for dz in span if max(abs(dx), abs(dy), abs(dz)) == _ring)
+
+
+class StationIndex:
+    def __init__(self, stations, cellKm=CELL_KM):
+        self.cell     = kmChord(cellKm)
+        self.position = {}                          # station: (lat, lon)
+        self.grid     = {}                          # cell: [(x, y, z, station), ...]
+        self.shells   = []                          # cell offsets by ring, grown as needed
+        for station, lat, lon in stations:
+            x, y, z = unitVector(lat, lon)
+            self.position[station] = (lat, lon)
+            self.grid.setdefault(self.key(x, y, z), []).append((x, y, z, station))
+
+    def __len__(self):
+        return len(self.position)
+
+    def key(self, _x, _y, _z):
+        return (math.floor(_x / self.cell), math.floor(_y / self.cell), math.floor(_z / self.cell))
+
+    # The _k stations nearest to _lat/_lon within _maxKm, closest first, as [(km, station), ...]
+    def nearest(self, _lat, _lon, _k=5, _maxKm=150, _exclude=()):
+        x, y, z = unitVector(_lat, _lon)
+        cx, cy, cz = self.key(x, y, z)
+        maxChord = kmChord(_maxKm)
+        found = []
+        ring = 0
+        while True:
+            if ring == len(self.shells):
+                self.shells.append(shell(ring))
+            for dx, dy, dz in self.shells[ring]:
+                for sx, sy, sz, station in self.grid.get((cx + dx, cy + dy, cz + dz), ()):
+                    chord = math.sqrt((sx - x) ** 2 + (sy - y) ** 2 + (sz - z) ** 2)
+                    if chord <= maxChord and station not in _exclude:
+                        found.append((chord, station))
+            # Everything not visited yet is more than ring * cell away
+            covered = ring * self.cell
+            if covered >= maxChord or (len(found) >= _k and sorted(found)[_k - 1][0] <= covered):
+                break
+            ring += 1
+        found.sort()
+        return [(chordKm(chord), station) for chord, station in found[:_k]]
+
+
+# The station list from the AWC cache file: [[station, lat, lon], ...] of everything that reports METARs
+def parseCatalog(_body):
+    import gzip
+    if _body[:2] == b'\x1f\x8b':
+        _body = gzip.decompress(_body)
+    stations = []
+    for entry in json.loads(_body):
+        station = entry.get('icaoId')
+        lat, lon = entry.get('lat'), entry.get('lon')
+        if not station or lat is None or lon is None:
+            continue
+        if 'siteType' in entry and 'METAR' not in entry['siteType']:
+            continue
+        stations.append([station, round(float(lat), 4), round(float(lon), 4)])
+    return stations
+
+
+# Load the station catalog from _path, downloading it with _download(url) -> bytes when it is missing or
+# older than _maxAge seconds. A stale copy is still used when the download fails. Returns None if there is
+# no catalog at all.
+def loadCatalog(_path, _download, _maxAge=30 * 86400):
+    try:
+        fresh = os.path.getmtime(_path) + _maxAge > time.time()
+    except OSError:
+        fresh = None
+    if not fresh:
+        body = _download(CATALOG_URL)
+        if body:
+            try:
+                stations = parseCatalog(body)
+                tmp = '{}.tmp'.format(_path)
+                with open(tmp, mode='w') as catalogFile:
+                    json.dump(stations, catalogFile, separators=(',', ':'))
+                os.replace(tmp, _path)
+                return stations
+            except (ValueError, OSError):
+                pass
+        if fresh is None:
+            return None
+    with open(_path) as catalogFile:
+        return json.load(catalogFile)
@@ -0,0 +1,39 @@
+"""
+Time sources for the METAR Clock.
+
+Everything that asks what time it is or waits for the next pass of the main
+loop goes through a time source, handed to the Fetcher and shared by the clocks
+and the scheduler. SystemTime is the real thing. SimulatedTime only moves when
+someone sleeps on it, so soak.py can run weeks of operation in minutes. Short
+waits for hardware (serial resync, display reboot) stay on real time.
+"""
+
+import time
+from datetime import datetime
+
+
+class SystemTime:
+    def time(self):
+        return time.time()
+
+    # The current time as an aware datetime in _tz
+    def now(self, _tz):
+        return datetime.now(_tz)
+
+    def sleep(self, _seconds):
+        time.sleep(_seconds)
+
+
+class SimulatedTime:
+    def __init__(self, start=0.0):
+        self.t = float(start)               # seconds since the epoch
+
+    def time(self):
+        return self.t
+
+    def now(self, _tz):
+        return datetime.fromtimestamp(self.t, _tz)
+
+    # Sleeping returns at once with the time moved on
+    def sleep(self, _seconds):
+        self.t += _seconds
@@ -0,0 +1,178 @@
+"""
+Prioritized serial writer for a Nextion display.
+
+Commands are queued by priority class and written by a dedicated thread:
+
+    SETTINGS    settings page and splash messages -- feedback for a touch
+    CLOCK       brightness, the clock tick and the network icons
+    DATA        everything else, mostly data page renders
+
+A newer write to a component that is still queued replaces the older one in
+place, so a display that falls behind skips stale values instead of replaying
+them. Page changes are barriers: everything queued before a page change is
+written before it, of every class, and nothing queued after it overtakes it or
+replaces a write from before it. So a splash message is on the splash page and
+the data page is only shown once its data has been written. The thread writes at most about 20ms worth of bytes at a time and waits
+for them to leave the port before picking the next batch, so a touch echo never
+sits behind more than that in the UART, whatever is queued.
+
+A write that fails on the writer thread drops everything queued and is
+reported to the failed callback, the owner takes the display out of use and
+repaints it once the port is back. With threaded=False every write goes straight
+to the port in the caller's thread and order, as before, and errors are raised
+to the caller. That is used for ports handed in by bench.py and
+soak.py, where writes have to happen at the caller's (possibly simulated) time.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from metrics import Counter, Gauge, Histogram
+
+EndCom = b'\xff\xff\xff'
+
+SETTINGS, CLOCK, DATA = 0, 1, 2
+CLASS_NAMES = ('settings', 'clock', 'data')
+
+# Priority class by component, or by page for components not listed. Everything else is DATA.
+CLASSES = {
+    b'settings':        SETTINGS,
+    b'splash':          SETTINGS,
+    b'dim':             CLOCK,
+    b'data.dtime.txt':  CLOCK,
+    b'data.wifi.aph':   CLOCK,
+    b'data.nowifi.aph': CLOCK,
+}
+
+# Queue depth buckets, in commands
+DEPTH = (0, 1, 2, 5, 10, 25, 50, 100, 250)
+
+NX_QUEUE      = Gauge('metarclock_nextion_queue_depth', 'Commands waiting for the Nextion writer')
+NX_DEPTH      = Histogram('metarclock_nextion_queue_depth_seen', 'Commands already waiting when a command is queued', DEPTH)
+NX_SUPERSEDED = Counter('metarclock_nextion_superseded_total', 'Queued commands replaced by a newer write to the same component', 'class')
+NX_WAIT       = Histogram('metarclock_nextion_settings_wait_seconds', 'Time from queueing a settings/touch command to it leaving the port')
+
+logger = logging.getLogger()
+
+
+# Supersede key and priority class of one command (without EndCom). Only assignments can be superseded,
+# any other command gets a key of its own.
+def classify(_command):
+    component, sep, value = _command.partition(b'=')
+    if not sep:
+        return object(), CLASSES.get(_command.split(b' ', 1)[0], DATA)
+    priority = CLASSES.get(component)
+    if priority is None:
+        priority = CLASSES.get(component.split(b'.', 1)[0], DATA)
+    return component, priority
+
+
+class SerialWriter:
+    def __init__(self, ser, written=None, threaded=True, failed=None):
+        self.ser      = ser
+        self.written  = written                 # called with the bytes of every write that reached the port
+        self.failed   = failed                  # called with the exception when a write on the writer thread fails
+        self.threaded = threaded
+        self.lock     = threading.RLock()       # held while the port is written, take it to use the port directly
+        self.cond     = threading.Condition()
+        self.segments = deque([self.segment()]) # writes between page changes, oldest first
+        self.depth    = 0
+        self.busy     = False
+        if threaded:
+            threading.Thread(target=self.run, name='nextion-writer', daemon=True).start()
+
+    # The writes queued between two page changes: per class key: (command, time queued), then the page
+    # change that ends them as (command, time queued), None while it is the last segment
+    def segment(self):
+        return [tuple(OrderedDict() for _ in CLASS_NAMES), None]
+
+    # Queue EndCom terminated commands, each in its own class unless _priority is given
+    def put(self, _data, _priority=None):
+        if not self.threaded:
+            self.write(_data)
+            return
+        now = time.perf_counter()
+        with self.cond:
+            for command in _data.split(EndCom):
+                if not command:
+                    continue
+                key, priority = classify(command)
+                if _priority is not None:
+                    priority = _priority
+                NX_DEPTH.observe(self.depth)
+                if command.startswith(b'page '):
+                    self.segments[-1][1] = (command + EndCom, now)
+                    self.segments.append(self.segment())
+                    self.depth += 1
+                    continue
+                queue = self.segments[-1][0][priority]
+                if key in queue:
+                    NX_SUPERSEDED.inc(_label=CLASS_NAMES[priority])
+                    queue[key] = (command + EndCom, queue[key][1])
+                else:
+                    queue[key] = (command + EndCom, now)
+                    self.depth += 1
+            NX_QUEUE.set(self.depth)
+            self.cond.notify_all()
+
+    # Wait until everything queued has left the port, returns False on timeout
+    def flush(self, _timeout=None):
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.depth and not self.busy, _timeout)
+
+    def write(self, _data):
+        with self.lock:
+            self.ser.write(_data)
+            if self.threaded:
+                self.ser.flush()                # wait for the bytes to leave so the next batch can be chosen
+        if self.written is not None:
+            self.written(_data)
+
+    # Writer thread: take the highest priority commands of the oldest segment, about 20ms worth at the port's
+    # speed, and write them. A page change goes out once its segment is empty, then the next segment starts.
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.depth)
+                limit = max(64, getattr(self.ser, 'baudrate', 115200) // 500)
+                batch = []
+                settings = []
+                size = 0
+                while size < limit:
+                    queues, page = self.segments[0]
+                    for priority, queue in enumerate(queues):
+                        while queue and size < limit:
+                            command, queued = queue.popitem(last=False)[1]
+                            batch.append(command)
+                            size += len(command)
+                            if priority == SETTINGS:
+                                settings.append(queued)
+                    if size >= limit or page is None:
+                        break
+                    batch.append(page[0])
+                    size += len(page[0])
+                    settings.append(page[1])
+                    self.segments.popleft()
+                self.depth -= len(batch)
+                self.busy = True
+                NX_QUEUE.set(self.depth)
+            try:
+                self.write(b''.join(batch))
+            except Exception as e:
+                with self.cond:
+                    dropped = len(batch) + self.depth
+                    self.segments = deque([self.segment()])
+                    self.depth = 0
+                    NX_QUEUE.set(0)
+                if self.failed is not None:
+                    self.failed(e)
+                else:
+                    logger.error('[SerialWriter] Nextion write failed, {} commands dropped: {}'.format(dropped, e))
+            now = time.perf_counter()
+            for queued in settings:
+                NX_WAIT.observe(now - queued)
+            with self.cond:
+                self.busy = False
+                self.cond.notify_all()